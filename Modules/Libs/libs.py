@@ -2,11 +2,27 @@ import customtkinter as ctk
 from functools import partial
 import threading
 import numpy as np
-import sounddevice as sd
-from scipy.signal import butter, lfilter
 
-from Modules.utils import note_to_frequency, normalize_wave, play_wave_dynamic, SAMPLE_RATE, MAX_FREQ, clamp
-from Modules.voice import Voice
-from Modules.adsr import ADSR
+from Modules.utils import note_to_frequency, normalize_wave, play_wave_dynamic, SAMPLE_RATE, MAX_FREQ, FILTER_BLOCK_SIZE, FILTER_CHUNK, FILTER_DESIGN_CACHE_SIZE, CUTOFF_STEP_CENTS, CONTROL_BLOCK, STREAM_BLOCK_SIZE, MAX_POLYPHONY, SAMPLE_DTYPE, KERNEL_BACKEND, AUDIO_BACKEND, clamp
+from Modules.kernels import kernel, set_backend as set_kernel_backend, backend as kernel_backend, available_backends, check_parity, prepare as prepare_kernels
+from Modules.buffers import ScratchBuffers, thread_scratch
+from Modules.adsr import ADSR, GatedADSR
 from Modules.filter import Filter
-from Modules.oscillator import Oscillator
\ No newline at end of file
+from Modules.wavetable import WavetableBank, WAVETABLES
+from Modules.oscillator import Oscillator
+from Modules.voice import Voice
+from Modules.cache import RenderCache, state_key
+from Modules.soundbank import SoundBank, SOUND_BANK_DIR
+from Modules.metrics import METRICS, Metrics, MetricsReporter, NoteTimeline
+from Modules.executor import render_executor, render_threads, set_render_threads, run_parallel
+from Modules.modulation import ModMatrix, LFO, EnvelopeSource, LFO_SHAPES, MOD_TARGETS, control_positions, to_audio_rate
+from Modules.patch import Patch, VoicePatch, compile_patch, compile_voice, unison_ratios
+from Modules.render import render_voice, render_patch, render_patch_note, render_notes, render_note, render_chord, VoiceStream, NoteStream, GatedNoteStream, stream_notes, stream_note
+from Modules.prerender import PreRenderer, KEYBOARD_NOTES
+from Modules.limiter import Limiter, LIMITER_LOOKAHEAD_MS, LIMITER_RELEASE_MS, LIMITER_CEILING
+from Modules.voice_pool import VoicePool, VoiceSlot
+from Modules.scheduler import Event, EventScheduler, EVENT_KINDS
+from Modules.midi import read_midi, events_to_notes, message_event, VirtualPort
+from Modules.engine import AudioEngine
+from Modules.backends import get_backend, SoundDeviceBackend, SimulatedBackend
+from Modules.convolution import PartitionedConvolver, load_impulse_response, preset_impulse_response, REVERB_PRESETS
@@ -1,27 +1,84 @@
-from Modules.Libs.libs import *
+from collections import OrderedDict
+import threading
+import numpy as np
+
+from Modules.utils import SAMPLE_RATE, SAMPLE_DTYPE
+from Modules.kernels import kernel
+
+ENVELOPE_CACHE_SIZE = 256 # Envelopes kept for reuse across notes
 
 class ADSR:
-    """Manages Attack, Decay, Sustain, and Release envelope generation."""
+    """Manages Attack, Decay, Sustain, and Release envelope generation.
+
+    Envelopes are memoized on (attack, decay, sustain, release, total_samples) in
+    a bounded LRU shared by all instances, and handed out as read-only arrays.
+    """
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
     def __init__(self, attack, decay, sustain, release):
         self.attack = attack
         self.decay = decay
         self.sustain = sustain
         self.release = release
     
-    def apply_envelope(self, wave, duration):
-        """Applies the ADSR envelope to a full waveform."""
-        total_samples = len(wave)
+    def apply_envelope(self, wave, duration, out=None):
+        """Applies the ADSR envelope to a full waveform (along the last axis).
+
+        Pass out (which may be wave itself) to write the result in place.
+        """
+        total_samples = wave.shape[-1]
         envelope = self.get_envelope(duration, total_samples=total_samples)
-        return wave * envelope
+        return np.multiply(wave, envelope, out=out)
 
     def get_envelope(self, duration, total_samples=None):
-        """Return the ADSR envelope as a numpy array of length total_samples.
+        """Return the ADSR envelope as a read-only SAMPLE_DTYPE array of length total_samples.
 
         If total_samples is None, it's calculated from duration and SAMPLE_RATE.
         """
         if total_samples is None:
             total_samples = int(max(0, duration * SAMPLE_RATE))
 
+        key = (self.attack, self.decay, self.sustain, self.release, total_samples)
+        with ADSR._cache_lock:
+            envelope = ADSR._cache.get(key)
+            if envelope is not None:
+                ADSR._cache.move_to_end(key)
+                return envelope
+
+        envelope = self._build_envelope(total_samples)
+        envelope.setflags(write=False)
+        with ADSR._cache_lock:
+            ADSR._cache[key] = envelope
+            while len(ADSR._cache) > ENVELOPE_CACHE_SIZE:
+                ADSR._cache.popitem(last=False)
+        return envelope
+
+    @staticmethod
+    def clear_cache():
+        """Empties the memoized envelopes (shared by all instances)."""
+        with ADSR._cache_lock:
+            ADSR._cache.clear()
+
+    def at(self, positions, total_samples):
+        """Returns the envelope of a total_samples note at the given sample positions
+        (float64, equal to get_envelope's samples at integer positions).
+
+        Used by the control-rate modulators, which only need a value every few
+        samples rather than the whole envelope.
+        """
+        points, values = [], []
+        idx = 0
+        for length, start, stop in zip(*self._segments(total_samples)):
+            points += [idx, idx + length - 1] if length > 1 else [idx]
+            values += [start, stop] if length > 1 else [start]
+            idx += length
+        if not points:
+            return np.zeros(np.shape(positions))
+        return np.interp(positions, points, values)
+
+    def _segments(self, total_samples):
+        """Returns the (lengths, starts, stops) of the envelope's straight segments."""
         # compute segment lengths in samples, clamping so they sum to total_samples
         attack_samples = min(int(self.attack * SAMPLE_RATE), total_samples)
         decay_samples = min(int(self.decay * SAMPLE_RATE), max(0, total_samples - attack_samples))
@@ -29,37 +86,101 @@ class ADSR:
 
         sustain_samples = max(0, total_samples - attack_samples - decay_samples - release_samples)
 
-        envelope = np.zeros(total_samples)
+        # Each segment is a straight line from its first to its last sample (a
+        # one-sample segment holds its start value), as np.linspace would give.
+        lengths, starts, stops = [], [], []
+        last = None
 
-        idx = 0
+        def segment(length, start, stop):
+            nonlocal last
+            lengths.append(length)
+            starts.append(start)
+            stops.append(stop)
+            last = stop if length > 1 else start
 
         # 1. Attack (0 to 1)
         if attack_samples > 0:
-            envelope[idx:idx + attack_samples] = np.linspace(0, 1, attack_samples)
-            idx += attack_samples
+            segment(attack_samples, 0.0, 1.0)
 
         # 2. Decay (1 to Sustain Level)
-        if decay_samples > 0 and idx < total_samples:
-            env_start = envelope[idx - 1] if idx > 0 else 1.0
-            write_len = min(decay_samples, total_samples - idx)
-            envelope[idx:idx + write_len] = np.linspace(env_start, self.sustain, write_len)
-            idx += write_len
+        if decay_samples > 0:
+            segment(decay_samples, last if lengths else 1.0, self.sustain)
 
         # 3. Sustain (Sustain Level)
-        if sustain_samples > 0 and idx < total_samples:
-            write_len = min(sustain_samples, total_samples - idx)
-            envelope[idx:idx + write_len] = self.sustain
-            idx += write_len
+        if sustain_samples > 0:
+            segment(sustain_samples, self.sustain, self.sustain)
 
         # 4. Release (Sustain Level to 0)
-        if release_samples > 0 and idx < total_samples:
-            env_start = envelope[idx - 1] if idx > 0 else self.sustain
-            write_len = min(release_samples, total_samples - idx)
-            envelope[idx:idx + write_len] = np.linspace(env_start, 0, write_len)
-            idx += write_len
+        if release_samples > 0:
+            segment(release_samples, last if lengths else self.sustain, 0.0)
 
         # If any samples remain (due to rounding), fill with 0
-        if idx < total_samples:
-            envelope[idx:] = 0.0
+        if sum(lengths) < total_samples:
+            segment(total_samples - sum(lengths), 0.0, 0.0)
+
+        return lengths, starts, stops
+
+    def _build_envelope(self, total_samples):
+        """Builds the envelope analytically, as straight segments in a single buffer."""
+        envelope = np.empty(total_samples, dtype=SAMPLE_DTYPE)
+        return kernel("linear_segments")(envelope, *self._segments(total_samples))
+
+
+class GatedADSR:
+    """The ADSR of a held note: attack, decay, then sustain for as long as the gate
+    is open, then the release segment from wherever the envelope was.
+
+    Values are computed for any sample positions (counted from the note start),
+    so the envelope can be evaluated block by block at audio or control rate.
+    """
+
+    def __init__(self, adsr=None):
+        self.reset(adsr)
+
+    def reset(self, adsr):
+        """Opens the gate of a new note."""
+        self.adsr = adsr
+        self.released_at = None # sample position of the note-off
+        self.release_level = 0.0
+        if adsr is None:
+            self._points = ([0], [0.0])
+            self.release_samples = 0
+            return
+        attack = int(adsr.attack * SAMPLE_RATE)
+        decay = int(adsr.decay * SAMPLE_RATE)
+        points = [(0, 0.0), (attack, 1.0)] if attack > 0 else [(0, 1.0)]
+        points.append((max(attack + decay, points[-1][0] + 1), adsr.sustain))
+        self._points = tuple(zip(*points))
+        self.release_samples = int(adsr.release * SAMPLE_RATE)
+
+    @property
+    def held_end(self):
+        """Position from which the held envelope stays at the sustain level."""
+        return self._points[0][-1]
+
+    def release(self, position):
+        """Closes the gate at a sample position (a second release is ignored)."""
+        if self.released_at is None:
+            self.released_at = position
+            self.release_level = float(np.interp(position, *self._points))
+
+    @property
+    def end(self):
+        """Position where the envelope reaches zero for good (None while it is held)."""
+        if self.released_at is not None:
+            return self.released_at + self.release_samples
+        if self.adsr is not None and self.adsr.sustain <= 0.0:
+            return self.held_end # silent from here on even before the note-off
+        return None
 
-        return envelope
\ No newline at end of file
+    def values(self, positions):
+        """Returns the (float64) envelope at the given sample positions."""
+        held = np.interp(positions, *self._points)
+        if self.released_at is None:
+            return held
+        since = np.asarray(positions, dtype=float) - self.released_at
+        if self.release_samples > 0:
+            falling = self.release_level * np.clip(1.0 - since / self.release_samples, 0.0, 1.0)
+        else:
+            falling = np.zeros_like(since)
+        return np.where(since >= 0, falling, held)
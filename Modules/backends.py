@@ -0,0 +1,345 @@
+"""Audio output backends, and a headless key-to-sound latency check.
+
+Usage:
+    python -m Modules.backends [--presses N] [--interval 0.5] [--blocksize 512]
+                               [--late BLOCK:MS ...] [--jitter MS --seed N]
+
+A backend opens output streams that call callback(outdata, frames, time_info,
+status) once per block, as sounddevice does:
+
+    SoundDeviceBackend   a real device through sounddevice/PortAudio
+    SimulatedBackend     no device: a clock-driven stand-in that can deliver
+                         callbacks late on purpose and records every block
+
+The engine and play_wave_dynamic take a backend; by default AUDIO_BACKEND (or
+the SYNTH_AUDIO_BACKEND environment variable) picks one, so headless runs can
+use "simulated".
+
+The command line plays held notes on an AudioEngine over a SimulatedBackend,
+with any late callbacks injected, and reports the key-to-sound latency of each
+press and the callbacks that missed their deadline. The simulated clock is
+stepped block by block, so the numbers are the same on every run and machine.
+"""
+from types import SimpleNamespace
+import argparse
+import json
+import os
+import threading
+import time
+import numpy as np
+
+from Modules.utils import AUDIO_BACKEND, STREAM_BLOCK_SIZE, SAMPLE_RATE
+
+class CallbackStop(Exception):
+    """Raised by a stream callback to end the stream after the current block."""
+
+
+class SoundDeviceBackend:
+    """Plays through sounddevice (PortAudio), imported when the first stream opens."""
+
+    name = "sounddevice"
+
+    def __init__(self):
+        self._sd = None
+
+    def _module(self):
+        if self._sd is None:
+            import sounddevice as sd
+            self._sd = sd
+        return self._sd
+
+    def clock(self):
+        return time.perf_counter()
+
+    def open_stream(self, samplerate, blocksize, channels, callback, dtype='float32'):
+        sd = self._module()
+
+        def device_callback(outdata, frames, time_info, status):
+            try:
+                callback(outdata, frames, time_info, status)
+            except CallbackStop:
+                raise sd.CallbackStop
+
+        return sd.OutputStream(samplerate=samplerate, blocksize=blocksize, channels=channels,
+                               dtype=dtype, callback=device_callback)
+
+    def sleep(self, ms):
+        self._module().sleep(ms)
+
+
+class _Status(SimpleNamespace):
+    """Callback status flags; true when any is set (like sounddevice's CallbackFlags)."""
+
+    def __bool__(self):
+        return any(vars(self).values())
+
+
+class SimulatedStream:
+    """An output stream of a SimulatedBackend.
+
+    The simulated device buffers one block: it asks for the next block when
+    it starts playing the previous one, so a callback may be up to a block
+    late before the device runs dry. A later callback is flagged as an output
+    underflow and the device plays silence until the block arrives, which
+    shifts everything after it. The recording is what the device played,
+    gaps included; recorded frame r plays at device time r / samplerate +
+    period. A callback's scheduled time is on that device timeline, and is
+    what clock() reports while it runs, so the engine maps its blocks to the
+    time they are heard.
+
+    With speed > 0 a thread calls the callback when it is delivered (speed 1
+    is realtime, 2 twice as fast); with speed 0 nothing runs until step() or
+    run_until() is called, which makes runs fully deterministic. Every
+    callback is logged as (block index, scheduled time, delivered time) in
+    simulated seconds.
+    """
+
+    def __init__(self, backend, samplerate, blocksize, channels, callback, dtype='float32'):
+        self.backend = backend
+        self.samplerate = samplerate
+        self.blocksize = blocksize or STREAM_BLOCK_SIZE # 0 lets a device choose; simulate the stream's
+        self.channels = channels
+        self.callback = callback
+        self.dtype = dtype
+        self.period = self.blocksize / samplerate
+        self.index = 0 # callbacks delivered
+        self.time = 0.0 # simulated time the last callback was delivered
+        self.scheduled = 0.0 # device time the last callback was asked for
+        self.played = 0 # frames the device has played or queued (blocks and underflow gaps)
+        self.blocks = [] # every block written, and the silence of every underflow gap
+        self.log = [] # (index, scheduled, delivered) per callback
+        self.underflows = 0 # callbacks that missed their deadline (each left a gap of silence)
+        self.error = None
+        self.active = False
+        self.finished = False
+        self.closed = False
+        self._thread = None
+        self._stop = threading.Event()
+        self._started_at = None
+
+    def start(self):
+        if self.active or self.finished or self.closed:
+            return
+        self.active = True
+        if self not in self.backend.streams:
+            self.backend.streams.append(self)
+        if self.backend.speed > 0:
+            self._stop.clear()
+            self._started_at = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self.active = False
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def close(self):
+        self.stop()
+        self.closed = True
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def clock(self):
+        """Simulated seconds since the stream started (stepped: the scheduled time
+        of the last callback)."""
+        if self._started_at is not None and self.active:
+            return (time.perf_counter() - self._started_at) * self.backend.speed
+        return self.scheduled
+
+    def step(self, blocks=1):
+        """Delivers the next blocks callbacks (speed 0). Returns how many ran."""
+        done = 0
+        while done < blocks and self.active:
+            self._deliver()
+            done += 1
+        return done
+
+    def run_until(self, when):
+        """Delivers every callback due by simulated time when (speed 0). Returns how many ran."""
+        done = 0
+        while self.active and self._next_delivery()[1] <= when:
+            self._deliver()
+            done += 1
+        return done
+
+    def recording(self):
+        """Everything the device played so far as one (frames, channels) array."""
+        if not self.blocks:
+            return np.zeros((0, self.channels), dtype=self.dtype)
+        return np.concatenate(self.blocks)
+
+    def first_sound(self, start=0, threshold=1e-4):
+        """Returns the first recorded frame at or after start whose level exceeds
+        threshold (on any channel), or None."""
+        loud = np.flatnonzero(np.abs(self.recording()[start:]).max(axis=1, initial=0.0) > threshold)
+        return start + int(loud[0]) if len(loud) else None
+
+    def _next_delivery(self):
+        """(scheduled, delivered) simulated times of the next callback."""
+        scheduled = self.played / self.samplerate # the device starts playing its last queued block
+        # callbacks run in order, so one after a late callback is held up too
+        return scheduled, max(scheduled + self.backend.lateness(self.index), self.time)
+
+    def _deliver(self):
+        index = self.index
+        scheduled, self.time = self._next_delivery()
+        # past the deadline the device has played out its buffered block and runs dry
+        gap = max(int(np.ceil((self.time - scheduled - self.period) * self.samplerate - 1e-9)), 0)
+        status = _Status(output_underflow=gap > 0, output_overflow=False,
+                         input_underflow=False, input_overflow=False, priming_output=False)
+        if gap:
+            self.underflows += 1
+            self.blocks.append(np.zeros((gap, self.channels), dtype=self.dtype))
+            self.played += gap
+        # the block is heard a buffered block after this (later by any gap)
+        self.scheduled = self.played / self.samplerate
+        self.played += self.blocksize
+        outdata = np.zeros((self.blocksize, self.channels), dtype=self.dtype)
+        time_info = SimpleNamespace(currentTime=self.time, outputBufferDacTime=self.scheduled + self.period)
+        self.index += 1
+        try:
+            self.callback(outdata, self.blocksize, time_info, status)
+        except CallbackStop:
+            self.active = False
+            self.finished = True
+        except Exception as error:
+            self.error = error
+            self.active = False
+            self.finished = True
+        self.blocks.append(outdata)
+        self.log.append((index, scheduled, self.time))
+
+    def _run(self):
+        while not self._stop.is_set() and self.active:
+            wait = self._started_at + self._next_delivery()[1] / self.backend.speed - time.perf_counter()
+            if wait > 0 and self._stop.wait(wait):
+                return
+            self._deliver()
+
+
+class SimulatedBackend:
+    """Headless backend whose streams are driven by a simulated device clock.
+
+    late maps block indexes to how many seconds late their callback is
+    delivered (or is a function index -> seconds); a callback more than a
+    block late makes the device run dry, and is flagged as an output
+    underflow, as a device would report. speed sets how fast the clock runs
+    against wall time; 0 steps only on demand (step(), run_until(), or
+    sleep(), which advances the open streams by that much audio).
+    """
+
+    name = "simulated"
+
+    def __init__(self, speed=0.0, late=None):
+        self.speed = speed
+        self.late = late or {}
+        self.streams = [] # every stream started (kept after closing, for its recording)
+
+    def lateness(self, index):
+        if callable(self.late):
+            return float(self.late(index) or 0.0)
+        return float(self.late.get(index, 0.0))
+
+    def clock(self):
+        """Simulated time of the first running stream (seconds)."""
+        for stream in self.streams:
+            if stream.active:
+                return stream.clock()
+        return 0.0
+
+    def open_stream(self, samplerate, blocksize, channels, callback, dtype='float32'):
+        return SimulatedStream(self, samplerate, blocksize, channels, callback, dtype)
+
+    def sleep(self, ms):
+        if self.speed > 0:
+            time.sleep(ms / 1000.0 / self.speed)
+            return
+        for stream in [stream for stream in self.streams if stream.active]:
+            stream.step(int(np.ceil(ms / 1000.0 / stream.period)))
+
+
+BACKENDS = {'sounddevice': SoundDeviceBackend, 'simulated': SimulatedBackend}
+
+def get_backend(name=None, **options):
+    """Returns a new backend by name (default: $SYNTH_AUDIO_BACKEND or AUDIO_BACKEND)."""
+    name = name or os.environ.get("SYNTH_AUDIO_BACKEND") or AUDIO_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"unknown audio backend {name!r}")
+    return BACKENDS[name](**options)
+
+
+def measure_key_latency(patch, presses=8, interval=0.5, hold=0.25, blocksize=STREAM_BLOCK_SIZE,
+                        late=None, samplerate=SAMPLE_RATE):
+    """Plays presses held notes of a compiled patch (interval seconds apart, each
+    held for hold seconds) through an AudioEngine on a stepped SimulatedBackend.
+
+    Returns {'latency_ms': [key press to first sound, per press], 'underflows',
+    'late_events', 'callbacks'}. Presses and sound are both timed on the
+    simulated device's timeline, so the latency includes the block the device
+    buffers and any silence a late callback left; a device's own hardware
+    latency comes on top.
+    """
+    from Modules.engine import AudioEngine # the engine opens its streams through this module
+    backend = SimulatedBackend(late=late)
+    engine = AudioEngine(samplerate, blocksize, backend=backend, name="simulated")
+    engine.patch = patch
+    engine.start()
+    stream = engine.stream
+    latencies = []
+    try:
+        for press in range(presses):
+            note, pressed_at = 60 + press % 12, press * interval
+            stream.run_until(pressed_at)
+            engine.port.send((0x90, note, 100), when=pressed_at)
+            stream.run_until(pressed_at + hold)
+            engine.port.send((0x80, note, 0), when=pressed_at + hold)
+            # recorded frame r is heard one buffered block after r / samplerate
+            onset = stream.first_sound(int(pressed_at * samplerate))
+            latencies.append(None if onset is None else
+                             ((onset + blocksize) / samplerate - pressed_at) * 1e3)
+        stream.run_until(presses * interval + interval)
+    finally:
+        engine.stop()
+    return {'latency_ms': latencies, 'underflows': stream.underflows,
+            'late_events': engine.scheduler.late_events, 'callbacks': stream.index}
+
+def _late_schedule(args):
+    late = {}
+    if args.jitter:
+        rng = np.random.default_rng(args.seed)
+        blocks = int(np.ceil((args.presses * args.interval + args.interval) * SAMPLE_RATE / args.blocksize))
+        late.update(enumerate(rng.exponential(args.jitter / 1000.0, blocks)))
+    for entry in args.late or []:
+        block, ms = entry.split(':')
+        late[int(block)] = float(ms) / 1000.0
+    return late
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure key-to-sound latency on a simulated output device.")
+    parser.add_argument('--presses', type=int, default=8, help="notes to play")
+    parser.add_argument('--interval', type=float, default=0.5, help="seconds between presses")
+    parser.add_argument('--blocksize', type=int, default=STREAM_BLOCK_SIZE, help="frames per callback")
+    parser.add_argument('--late', action='append', metavar="BLOCK:MS", help="deliver callback BLOCK MS late (repeatable)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="mean lateness of every callback in ms (exponential)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the --jitter lateness")
+    args = parser.parse_args(argv)
+
+    from Modules.offline import make_patch, note_state
+    from Modules.patch import compile_patch
+    from Modules.wavetable import WAVETABLES
+    WAVETABLES.build_all()
+    patch = compile_patch(note_state(make_patch(), 60, args.interval))
+    result = measure_key_latency(patch, args.presses, args.interval, args.interval / 2, args.blocksize,
+                                 _late_schedule(args))
+    print(json.dumps(result, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""Benchmarks of the render stages: what a key press costs.
+
+Usage:
+    python -m Modules.benchmark [--quick] [--repeat N] [--output results.json]
+                                [--kernels numpy|numba|auto]
+                                [--baseline baseline.json] [--tolerance 0.25]
+                                [--save-baseline baseline.json]
+
+Every stage is timed over a matrix of waveforms, unison counts, filter types,
+Q values and note durations (the convolution stage over impulse response
+lengths, in stream-sized blocks). For each case the best of --repeat runs is
+reported with its throughput (samples/s) and realtime factor (seconds of audio
+rendered per second of wall time). With --baseline the run fails (exit code 1)
+when a case is more than --tolerance slower than the stored result.
+"""
+from contextlib import nullcontext
+from types import SimpleNamespace
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+
+from Modules.utils import note_to_frequency, SAMPLE_RATE
+from Modules.adsr import ADSR
+from Modules.filter import Filter
+from Modules.oscillator import Oscillator
+from Modules.wavetable import WAVETABLES
+from Modules.patch import unison_ratios, compile_patch
+from Modules.convolution import PartitionedConvolver, reverb_impulse_response, CONVOLUTION_PARTITION
+from Modules import kernels
+
+WAVEFORMS = ["Sine", "Square", "Sawtooth*8", "Square*16"]
+UNISON_COUNTS = [1, 3, 7]
+FILTER_TYPES = ["None", "Low-pass", "High-pass", "Band-pass"]
+Q_VALUES = [1.0, 4.0]
+DURATIONS = [0.25, 0.5, 2.0]
+IR_SECONDS = [0.5, 2.0, 5.0] # impulse response lengths of the convolution stage
+
+# Reduced matrix for --quick
+QUICK_MATRIX = {
+    'waveforms': ["Sine", "Sawtooth*8"], 'unison': [1, 7], 'filters': ["Low-pass", "Band-pass"],
+    'q': [1.0], 'durations': [0.5]
+}
+
+def _time(func, repeat, setup=None):
+    """Returns the sorted wall times of repeat calls of func (setup runs untimed before each)."""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return sorted(times)
+
+def _result(stage, case, samples, times):
+    best = times[0]
+    audio_seconds = samples / SAMPLE_RATE
+    return {
+        'stage': stage,
+        'case': case,
+        'samples': samples,
+        'best_s': best,
+        'median_s': times[len(times) // 2],
+        'samples_per_s': samples / best if best > 0 else float('inf'),
+        'realtime_factor': audio_seconds / best if best > 0 else float('inf'),
+    }
+
+def _state(waveform, unison, filter_type, q, duration, note=60):
+    voice = {
+        'waveform': waveform, 'detune': 0.0, 'unison': unison,
+        'adsr_vars': {'attack': 0.01, 'decay': 0.25, 'sustain': 0.3, 'release': 0.13},
+        'filter_vars': {'filter_type': filter_type, 'cutoff': 2000.0, 'resonance': q}
+    }
+    return {
+        'note': note, 'duration': duration, 'freq': note_to_frequency(note),
+        'voice1_params': voice, 'use_voice2': True, 'voice2_params': dict(voice, detune=7.0),
+        'amp_adsr_vars': {'attack': 0.01, 'decay': 0.1, 'sustain': 0.5, 'release': 0.1},
+        'mix_level': 0.5
+    }
+
+def bench_oscillator(matrix, repeat):
+    results = []
+    for waveform in matrix['waveforms']:
+        for unison in matrix['unison']:
+            for duration in matrix['durations']:
+                osc = Oscillator(waveform)
+                freqs = note_to_frequency(60) * unison_ratios(0.0, unison)
+                times = _time(lambda: osc.generate(freqs, duration), repeat)
+                case = {'waveform': waveform, 'unison': unison, 'duration': duration}
+                results.append(_result('oscillator', case, unison * int(SAMPLE_RATE * duration), times))
+    return results
+
+def bench_envelope(matrix, repeat):
+    results = []
+    adsr = ADSR(0.01, 0.25, 0.3, 0.13)
+    for duration in matrix['durations']:
+        samples = int(SAMPLE_RATE * duration)
+        # a cold build (the memoized envelope is dropped before every run) ...
+        times = _time(lambda: adsr.get_envelope(duration), repeat, setup=ADSR.clear_cache)
+        results.append(_result('get_envelope', {'duration': duration}, samples, times))
+        # ... and applying it to a note, in place
+        wave = np.ones(samples)
+        times = _time(lambda: adsr.apply_envelope(wave, duration, out=wave), repeat)
+        results.append(_result('apply_envelope', {'duration': duration}, samples, times))
+    return results
+
+def bench_filter(matrix, repeat):
+    results = []
+    rng = np.random.default_rng(0)
+    for filter_type in matrix['filters']:
+        for q in matrix['q']:
+            for duration in matrix['durations']:
+                samples = int(SAMPLE_RATE * duration)
+                data = rng.uniform(-1.0, 1.0, samples)
+                filter_obj = Filter(filter_type, 2000.0, q)
+                case = {'filter_type': filter_type, 'q': q, 'duration': duration}
+                if filter_type == "Low-pass":
+                    # time-varying path: cutoff swept by an envelope
+                    sweep = 20.0 + ADSR(0.01, 0.25, 0.3, 0.13).get_envelope(duration, samples) * 1980.0
+                    times = _time(lambda: filter_obj.apply(data, cutoff_envelope=sweep), repeat)
+                    results.append(_result('filter_sweep', case, samples, times))
+                if filter_type != "None":
+                    times = _time(lambda: filter_obj.apply(data), repeat)
+                    results.append(_result('filter_static', case, samples, times))
+    return results
+
+def bench_convolution(matrix, repeat):
+    """Times the master-bus convolution over stream-sized blocks, per impulse response length."""
+    results = []
+    for seconds in IR_SECONDS:
+        convolver = PartitionedConvolver(reverb_impulse_response(seconds), wet=0.3, dry=1.0)
+        block = np.zeros(CONVOLUTION_PARTITION, dtype=np.float32)
+        blocks = max(int(SAMPLE_RATE * max(matrix['durations']) / CONVOLUTION_PARTITION), 1)
+
+        def run():
+            for _ in range(blocks):
+                convolver.process(block, out=block)
+
+        times = _time(run, repeat)
+        case = {'ir_seconds': seconds, 'partitions': convolver.n_partitions}
+        results.append(_result('convolution', case, blocks * CONVOLUTION_PARTITION, times))
+    return results
+
+class _NoCache:
+    """Render cache stand-in that never hits, so every run renders."""
+
+    def get(self, key):
+        return None
+
+    def put(self, key, wave):
+        return wave
+
+def bench_full_render(matrix, repeat):
+    """Times SynthApp._play_in_thread (the render of a compiled patch) with the cache
+    bypassed and playback stubbed out."""
+    from main import SynthApp
+    app = SimpleNamespace(render_cache=_NoCache(), engine=SimpleNamespace(play_wave=lambda wave, **kwargs: None),
+                          prerender=SimpleNamespace(foreground=nullcontext))
+    results = []
+    for waveform in matrix['waveforms']:
+        for unison in matrix['unison']:
+            for filter_type in matrix['filters']:
+                for q in matrix['q']:
+                    for duration in matrix['durations']:
+                        patch = compile_patch(_state(waveform, unison, filter_type, q, duration))
+                        times = _time(lambda: SynthApp._play_in_thread(app, patch, 60), repeat)
+                        case = {'waveform': waveform, 'unison': unison, 'filter_type': filter_type,
+                                'q': q, 'duration': duration}
+                        results.append(_result('full_render', case, int(SAMPLE_RATE * duration), times))
+    return results
+
+STAGES = {
+    'oscillator': bench_oscillator,
+    'envelope': bench_envelope,
+    'filter': bench_filter,
+    'full_render': bench_full_render,
+    'convolution': bench_convolution,
+}
+
+def run(stages=None, quick=False, repeat=5):
+    """Runs the selected stages (all by default) and returns the results document."""
+    matrix = QUICK_MATRIX if quick else {
+        'waveforms': WAVEFORMS, 'unison': UNISON_COUNTS, 'filters': FILTER_TYPES,
+        'q': Q_VALUES, 'durations': DURATIONS
+    }
+    WAVETABLES.build_all()
+    kernels.prepare()
+    results = []
+    for name in stages or STAGES:
+        results.extend(STAGES[name](matrix, repeat))
+    return {
+        'meta': {
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'machine': platform.machine(), 'sample_rate': SAMPLE_RATE, 'repeat': repeat, 'quick': quick,
+            'kernels': kernels.backend()
+        },
+        'results': results
+    }
+
+def _key(result):
+    return result['stage'], json.dumps(result['case'], sort_keys=True)
+
+def compare(results, baseline, tolerance=0.25):
+    """Returns the cases that are more than tolerance (a fraction) slower than in baseline."""
+    reference = {_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        old = reference.get(_key(result))
+        if old is not None and result['best_s'] > old['best_s'] * (1.0 + tolerance):
+            regressions.append({
+                'stage': result['stage'], 'case': result['case'],
+                'baseline_s': old['best_s'], 'best_s': result['best_s'],
+                'slowdown': result['best_s'] / old['best_s']
+            })
+    return regressions
+
+def _print_table(results):
+    for result in results['results']:
+        case = ", ".join(f"{key}={value}" for key, value in result['case'].items())
+        print(f"{result['stage']:<15} {case:<70} {result['best_s'] * 1e3:9.3f} ms "
+              f"{result['samples_per_s'] / 1e6:8.2f} MS/s {result['realtime_factor']:9.1f}x realtime")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the render stages of the synth.")
+    parser.add_argument('--stage', action='append', choices=sorted(STAGES), help="stage to run (repeatable, default: all)")
+    parser.add_argument('--quick', action='store_true', help="run a reduced parameter matrix")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per case, the best one is reported")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="fail if a case regresses against this results file")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument('--save-baseline', help="store the results as the new baseline")
+    parser.add_argument('--kernels', choices=("auto",) + kernels.BACKENDS, help="kernel backend (default: KERNEL_BACKEND)")
+    args = parser.parse_args(argv)
+    if args.kernels:
+        kernels.set_backend(args.kernels)
+
+    results = run(args.stage, args.quick, max(1, args.repeat))
+    _print_table(results)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['stage']} {regression['case']}: "
+                  f"{regression['baseline_s'] * 1e3:.3f} ms -> {regression['best_s'] * 1e3:.3f} ms "
+                  f"({regression['slowdown']:.2f}x)")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
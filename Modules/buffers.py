@@ -0,0 +1,40 @@
+import threading
+import numpy as np
+
+from Modules.utils import SAMPLE_DTYPE
+
+class ScratchBuffers:
+    """Named scratch arrays that are allocated once and reused from call to call.
+
+    get() hands out a view of the stored array for the requested shape, growing
+    it only when a larger one is asked for. The contents are not cleared, and a
+    view stays valid only until the next get() of the same name, so a set of
+    buffers must not be shared between threads (see thread_scratch).
+    """
+
+    def __init__(self, dtype=SAMPLE_DTYPE):
+        self.dtype = np.dtype(dtype)
+        self._arrays = {}
+
+    def get(self, name, shape, dtype=None):
+        dtype = self.dtype if dtype is None else np.dtype(dtype)
+        shape = tuple(np.atleast_1d(shape))
+        size = int(np.prod(shape))
+        array = self._arrays.get(name)
+        if array is None or array.size < size or array.dtype != dtype:
+            array = np.empty(size, dtype=dtype)
+            self._arrays[name] = array
+        return array[:size].reshape(shape)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._arrays.values())
+
+_local = threading.local()
+
+def thread_scratch():
+    """Returns the ScratchBuffers of the calling thread."""
+    scratch = getattr(_local, 'scratch', None)
+    if scratch is None:
+        scratch = _local.scratch = ScratchBuffers()
+    return scratch
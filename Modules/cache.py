@@ -0,0 +1,96 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import numpy as np
+
+def state_key(state):
+    """Returns a canonical hash of a note state dict (order of keys does not matter)."""
+    canonical = json.dumps(state, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+class RenderCache:
+    """Bounded LRU cache of rendered note buffers keyed by the note state.
+
+    Buffers are stored read-only and evicted least-recently-used first once the
+    total size goes over max_mb megabytes. With a SoundBank as bank, new
+    buffers are also written to disk and misses are looked up there (the
+    memory-mapped result is then kept in memory like any other entry).
+    """
+
+    def __init__(self, max_mb=64, bank=None):
+        self.bank = bank
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """Checks for key (in memory or in the bank) without counting a hit or miss."""
+        with self._lock:
+            if key in self._entries:
+                return True
+        return self.bank is not None and key in self.bank
+
+    def get(self, key):
+        """Returns the cached buffer for key, or None."""
+        with self._lock:
+            wave = self._entries.get(key)
+            if wave is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return wave
+
+        if self.bank is not None:
+            wave = self.bank.get(key)
+            if wave is not None:
+                with self._lock:
+                    self.hits += 1
+                return self._insert(key, wave)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, wave):
+        """Stores wave under key and returns the read-only cached array."""
+        wave = np.array(wave, copy=True)
+        wave.setflags(write=False)
+        if self.bank is not None:
+            self.bank.put(key, wave)
+        return self._insert(key, wave)
+
+    def _insert(self, key, wave):
+        if wave.nbytes > self.max_bytes:
+            return wave # would evict everything and still not fit
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size_bytes -= old.nbytes
+            self._entries[key] = wave
+            self.size_bytes += wave.nbytes
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size_bytes -= evicted.nbytes
+                self.evictions += 1
+        return wave
+
+    def clear(self):
+        """Drops every cached buffer (e.g. after a parameter change)."""
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self):
+        """Returns the hit/miss/eviction counters and current memory use."""
+        return {
+            'entries': len(self._entries), 'size_mb': self.size_bytes / (1024 * 1024),
+            'max_mb': self.max_bytes / (1024 * 1024),
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions
+        }
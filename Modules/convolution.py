@@ -0,0 +1,168 @@
+"""Master-bus convolution effect: uniformly partitioned FFT convolution.
+
+The impulse response is cut into partitions of CONVOLUTION_PARTITION samples
+whose spectra are computed once, when the convolver is built. Each block of
+input then costs one FFT/inverse FFT pair of twice the partition size, a fixed
+cost, plus a multiply-accumulate of the stored input spectra against the
+partition spectra (overlap-save with a frequency-domain delay line), which
+grows linearly with the number of partitions. The latency is one partition,
+whatever the length of the response.
+"""
+from math import gcd
+import numpy as np
+
+from Modules.utils import SAMPLE_RATE, STREAM_BLOCK_SIZE, SAMPLE_DTYPE
+from Modules.kernels import kernel
+
+CONVOLUTION_PARTITION = STREAM_BLOCK_SIZE # Samples per partition (= the effect's latency)
+IR_MAX_SECONDS = 10.0 # Longer impulse responses are cut
+IR_SILENCE = 1e-4 # Trailing samples below this fraction of the peak are trimmed
+# Synthetic reverb responses: reverberation time (RT60) in seconds
+REVERB_PRESETS = {'Room': 0.4, 'Hall': 2.0, 'Cathedral': 5.0}
+
+def _trim(ir, max_seconds, samplerate):
+    ir = ir[:int(max_seconds * samplerate)]
+    peak = np.max(np.abs(ir)) if len(ir) else 0.0
+    if peak == 0.0:
+        raise ValueError("impulse response is silent")
+    return ir[:np.flatnonzero(np.abs(ir) > peak * IR_SILENCE)[-1] + 1]
+
+def _unit_energy(ir):
+    """Scales an impulse response to unit energy, so its output sits near the dry level."""
+    return (ir / np.sqrt(np.sum(np.square(ir, dtype=float)))).astype(SAMPLE_DTYPE)
+
+def load_impulse_response(path, samplerate=SAMPLE_RATE, max_seconds=IR_MAX_SECONDS, normalize=True):
+    """Reads an impulse response from a WAV (any sample format) or .npy file.
+
+    Channels are averaged to mono, the response is resampled to samplerate,
+    cut to max_seconds with its silent tail trimmed, and (normalize) scaled
+    to unit energy.
+    """
+    if path.endswith('.npy'):
+        rate, data = samplerate, np.load(path)
+    else:
+        from scipy.io import wavfile
+        rate, data = wavfile.read(path)
+    if data.dtype.kind == 'u':
+        data = (data.astype(float) - 2.0 ** (8 * data.itemsize - 1)) / 2.0 ** (8 * data.itemsize - 1)
+    elif data.dtype.kind == 'i':
+        data = data / 2.0 ** (8 * data.itemsize - 1)
+    data = np.asarray(data, dtype=float)
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if rate != samplerate:
+        from scipy.signal import resample_poly
+        divisor = gcd(int(rate), int(samplerate))
+        data = resample_poly(data, int(samplerate) // divisor, int(rate) // divisor)
+    data = _trim(data, max_seconds, samplerate)
+    return _unit_energy(data) if normalize else data.astype(SAMPLE_DTYPE)
+
+def reverb_impulse_response(rt60, samplerate=SAMPLE_RATE, seed=0):
+    """Synthetic reverb: noise decaying by 60 dB over rt60 seconds, with its highs
+    damped faster than its lows, scaled to unit energy."""
+    rng = np.random.default_rng(seed)
+    n = int(rt60 * samplerate)
+    t = np.arange(n) / samplerate
+    noise = rng.standard_normal(n) * 10.0 ** (-3.0 * t / rt60)
+    # blend towards a smoothed copy as the tail decays (air absorbs highs first)
+    smooth = np.convolve(noise, np.ones(8) / 8.0, mode='same')
+    blend = np.minimum(t / rt60 * 2.0, 1.0)
+    return _unit_energy((1.0 - blend) * noise + blend * smooth)
+
+def preset_impulse_response(name, samplerate=SAMPLE_RATE):
+    """The impulse response of a REVERB_PRESETS entry, or of the file at path name."""
+    if name in REVERB_PRESETS:
+        return reverb_impulse_response(REVERB_PRESETS[name], samplerate)
+    return load_impulse_response(name, samplerate)
+
+
+class PartitionedConvolver:
+    """Convolves a mono stream with an impulse response, block by block.
+
+    process() takes blocks of any length and returns them delayed by exactly
+    partition samples (latency) as dry * input + wet * input convolved with
+    the response. wet and dry are plain floats, so they can be changed while
+    the audio thread runs; a new response means a new convolver (its spectra
+    are built by the constructor, off the audio thread).
+    """
+
+    def __init__(self, ir, partition=CONVOLUTION_PARTITION, wet=1.0, dry=0.0):
+        ir = np.asarray(ir, dtype=SAMPLE_DTYPE)
+        self.partition = partition
+        self.wet = wet
+        self.dry = dry
+        self.ir_length = len(ir)
+        self.n_partitions = max(-(-len(ir) // partition), 1)
+        parts = np.zeros(self.n_partitions * partition, dtype=SAMPLE_DTYPE)
+        parts[:len(ir)] = ir
+        padded = np.zeros((self.n_partitions, 2 * partition), dtype=SAMPLE_DTYPE)
+        padded[:, :partition] = parts.reshape(self.n_partitions, partition)
+        # newest input spectrum pairs with the first partition: store them reversed
+        self.spectra = np.ascontiguousarray(np.fft.rfft(padded, axis=1)[::-1])
+        bins = partition + 1
+        # frequency-domain delay line, twice over so the last n_partitions input
+        # spectra are always one contiguous, oldest-first slice
+        self._history = np.zeros((2 * self.n_partitions, bins), dtype=self.spectra.dtype)
+        self._sum = np.zeros(bins, dtype=self.spectra.dtype)
+        self._product = np.empty_like(self.spectra) # scratch for the multiply-accumulate
+        self._frame = np.zeros(2 * partition, dtype=SAMPLE_DTYPE) # previous and current input partition
+        self._out = np.zeros(partition, dtype=SAMPLE_DTYPE) # output of the last partition, read while the next fills
+        self._fill = 0
+        self._pos = 0
+
+    @property
+    def latency(self):
+        return self.partition
+
+    @property
+    def tail(self):
+        """Samples the output keeps ringing after the input stops."""
+        return self.ir_length - 1
+
+    def reset(self):
+        self._history.fill(0.0)
+        self._frame.fill(0.0)
+        self._out.fill(0.0)
+        self._fill = 0
+        self._pos = 0
+
+    def process(self, block, out=None):
+        """Processes a 1-D block (out may be block itself). Returns out."""
+        out = np.empty_like(block) if out is None else out
+        size = self.partition
+        current = self._frame[size:]
+        done = 0
+        while done < len(block):
+            fill = self._fill
+            n = min(size - fill, len(block) - done)
+            current[fill:fill + n] = block[done:done + n]
+            out[done:done + n] = self._out[fill:fill + n]
+            self._fill += n
+            done += n
+            if self._fill == size:
+                self._convolve_partition()
+                self._fill = 0
+        return out
+
+    def _convolve_partition(self):
+        size, count = self.partition, self.n_partitions
+        spectrum = np.fft.rfft(self._frame)
+        self._history[self._pos] = spectrum
+        self._history[self._pos + count] = spectrum
+        self._pos = (self._pos + 1) % count
+        kernel("spectral_mac")(self.spectra, self._history[self._pos:self._pos + count], self._sum,
+                                self._product)
+        # overlap-save: the second half of the circular convolution is the linear one
+        np.multiply(np.fft.irfft(self._sum, 2 * size)[size:], self.wet, out=self._out)
+        if self.dry:
+            self._out += self.dry * self._frame[size:]
+        self._frame[:size] = self._frame[size:]
+
+def convolve(wave, ir, wet=1.0, dry=0.0, partition=CONVOLUTION_PARTITION):
+    """Offline: returns dry * wave + wet * (wave convolved with ir), including the
+    tail (len(wave) + len(ir) - 1 samples) and without the streaming latency."""
+    convolver = PartitionedConvolver(ir, partition, wet, dry)
+    length = len(wave) + convolver.tail
+    padded = np.zeros(length + partition, dtype=SAMPLE_DTYPE)
+    padded[:len(wave)] = wave
+    return convolver.process(padded)[partition:]
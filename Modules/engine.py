@@ -0,0 +1,207 @@
+from collections import deque
+from functools import partial
+import itertools
+import time
+
+from Modules.utils import SAMPLE_RATE, STREAM_BLOCK_SIZE, MAX_POLYPHONY
+from Modules.metrics import METRICS
+from Modules.voice_pool import VoicePool
+from Modules.limiter import Limiter
+from Modules.scheduler import EventScheduler
+from Modules.midi import VirtualPort
+from Modules.backends import get_backend
+
+_stream_ids = itertools.count(1)
+
+class StreamVoice:
+    """Plays back a note that is rendered on the fly by an iterator of sample blocks."""
+
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.pending = None # unplayed tail of the last block
+        self.finished = False
+
+    def mix_into(self, out):
+        """Adds the next len(out) samples to out. Returns False once the voice has finished."""
+        written = 0
+        while written < len(out) and not self.finished:
+            if self.pending is None or len(self.pending) == 0:
+                self.pending = next(self.blocks, None)
+                if self.pending is None:
+                    self.finished = True
+                    break
+            count = min(len(out) - written, len(self.pending))
+            out[written:written + count] += self.pending[:count]
+            self.pending = self.pending[count:]
+            written += count
+        return not (self.finished and (self.pending is None or len(self.pending) == 0))
+
+
+class AudioEngine:
+    """Owns a single output stream for the app's lifetime and mixes all active voices into it.
+
+    Note triggers only append a request to a queue; the audio callback is the only
+    consumer and assigns each note a slot of a fixed VoicePool, so no locks are
+    taken on the audio thread and at most max_polyphony notes sound at once.
+    The mixed bus goes through the master effects (objects with process(block,
+    out), e.g. a PartitionedConvolver, swapped as a whole by set_effects or an
+    'effects' param event) and then a look-ahead Limiter (with the master
+    gain), so notes keep their relative level and the output is delayed by
+    limiter.latency plus the effects' latency.
+
+    Timestamped events (held notes, note-offs, parameter changes) go through
+    the EventScheduler instead: the callback splits its block at each event's
+    sample offset, mixes up to it and applies the event there. Parameter events
+    call the handler registered under their name in param_handlers.
+    Status flags, callback durations and note timelines are recorded in METRICS
+    under the engine's name.
+    """
+
+    def __init__(self, samplerate=SAMPLE_RATE, blocksize=STREAM_BLOCK_SIZE, channels=1,
+                 max_polyphony=MAX_POLYPHONY, steal_policy="oldest", retrigger=True, name=None,
+                 master_gain=1.0, backend=None):
+        self.name = name or f"stream{next(_stream_ids)}"
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.channels = channels
+        self.backend = backend or get_backend() # opens the output stream (sounddevice, simulated, ...)
+        self.stream = None
+        self._pending = deque() # note requests queued by any thread (deque append/popleft are atomic)
+        self.pool = VoicePool(max_polyphony, steal_policy, retrigger) # only touched by the audio callback
+        self.limiter = Limiter(samplerate, master_gain=master_gain) # only touched by the audio callback
+        self.status_count = 0 # callbacks reporting an underflow/overflow
+        self.last_status = None
+        self.frame = 0 # samples played since the stream started (the scheduler's clock)
+        self.scheduler = EventScheduler(samplerate, latency=blocksize, clock=self.backend.clock)
+        self.port = VirtualPort(self.scheduler)
+        self.patch = None # played by note_on events that carry no patch
+        self.effects = () # master effects in order (replaced whole, never mutated)
+        self.param_handlers = {
+            'patch': partial(setattr, self, 'patch'),
+            'effects': partial(setattr, self, 'effects'),
+            'master_gain': partial(setattr, self, 'master_gain'),
+        }
+
+    def start(self):
+        """Opens and starts the output stream. Device errors are raised to the caller."""
+        if self.stream is not None:
+            return
+        self.stream = self.backend.open_stream(
+            self.samplerate, self.blocksize, self.channels, self._callback, dtype='float32'
+        )
+        self.stream.start()
+
+    def stop(self):
+        """Stops and closes the output stream and drops every queued or sounding voice."""
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        self._pending.clear()
+        self.scheduler.clear()
+        self.pool.reset()
+        for effect in self.effects:
+            effect.reset()
+        self.limiter.reset()
+
+    def note_on(self, note=None, wave=None, patch=None, source=None, timeline=None):
+        """Queues a note: a rendered wave, a compiled Patch (rendered at the pitch of
+        note, block by block, in the slot it gets) or a voice object. note is the MIDI note used for
+        same-note retriggering (None never retriggers). A NoteTimeline gets its
+        first_callback and last_sample marks from the audio thread."""
+        self._pending.append((note, wave, patch, source, timeline))
+
+    def play(self, voice):
+        """Queues a voice (anything with mix_into(out)) for playback."""
+        self.note_on(source=voice)
+
+    def play_wave(self, wave, note=None, timeline=None):
+        """Queues a fully rendered wave for playback."""
+        self.note_on(note, wave=wave, timeline=timeline)
+
+    def play_events(self, events, start=None):
+        """Schedules a sequence of Events (frames relative to start, by default one
+        block from now), e.g. from Modules.midi.read_midi."""
+        self.scheduler.schedule(events, start)
+
+    def set_effects(self, effects):
+        """Replaces the master effects (from any thread) from the next block on."""
+        self.effects = tuple(effects) # one reference store, read once per callback
+
+    def play_blocks(self, blocks, note=None):
+        """Queues an iterator of sample blocks for playback."""
+        self.note_on(note, source=StreamVoice(blocks))
+
+    @property
+    def master_gain(self):
+        return self.limiter.master_gain
+
+    @master_gain.setter
+    def master_gain(self, gain):
+        self.limiter.master_gain = gain # a float store, read once per callback
+
+    @property
+    def active_voices(self):
+        return self.pool.active_count
+
+    @property
+    def error_count(self):
+        return self.pool.error_count
+
+    @property
+    def last_error(self):
+        return self.pool.last_error
+
+    def stats(self):
+        """Returns the voice pool counters (active, steals, ...) plus stream status counts."""
+        stats = self.pool.stats()
+        stats['status_count'] = self.status_count
+        stats['late_events'] = self.scheduler.late_events
+        stats['limiter_gain_db'] = self.limiter.gain_db
+        return stats
+
+    def _callback(self, outdata, frames, time_info, status):
+        started = time.perf_counter()
+        if status:
+            self.status_count += 1
+            self.last_status = status
+            METRICS.record_stream_status(self.name, status)
+
+        while self._pending:
+            self.pool.note_on(*self._pending.popleft())
+
+        mix = outdata[:, 0]
+        mix.fill(0.0)
+        offset = 0
+        for at, event in self.scheduler.due(self.frame, frames, self.backend.clock()):
+            if at > offset:
+                self.pool.mix_into(mix[offset:at])
+                offset = at
+            self._apply(event)
+        if offset < frames:
+            self.pool.mix_into(mix[offset:])
+        self.frame += frames
+
+        for effect in self.effects:
+            effect.process(mix, out=mix)
+        self.limiter.process(mix, out=mix)
+        if self.channels > 1:
+            outdata[:, 1:] = outdata[:, :1]
+
+        METRICS.record_callback(self.name, time.perf_counter() - started, frames / self.samplerate)
+
+    def _apply(self, event):
+        """Audio thread: applies a due event at the current point of the block."""
+        if event.kind == "note_on":
+            patch = event.value if event.value is not None else self.patch
+            if patch is not None:
+                self.pool.note_on(event.note, patch=patch, timeline=event.timeline, gated=True,
+                                  velocity=event.velocity)
+        elif event.kind == "note_off":
+            self.pool.note_off(event.note)
+        else:
+            handler = self.param_handlers.get(event.name)
+            if handler is None:
+                METRICS.counter(f"{self.name}.unknown_params").inc()
+            else:
+                handler(event.value)
@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+
+from Modules.utils import RENDER_THREADS
+
+_executor = None
+_threads = RENDER_THREADS
+_lock = threading.Lock()
+
+def render_threads():
+    """Returns the number of threads the shared render executor uses (1 = serial)."""
+    return max(1, _threads or os.cpu_count() or 1)
+
+def set_render_threads(count):
+    """Resizes the shared render executor; None means one thread per core and
+    1 (or less) renders serially on the calling thread."""
+    global _executor, _threads
+    with _lock:
+        old, _executor = _executor, None
+        _threads = count
+    if old is not None:
+        old.shutdown(wait=True)
+
+def render_executor():
+    """Returns the shared render executor, or None when rendering serially."""
+    global _executor
+    if render_threads() <= 1:
+        return None
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=render_threads(), thread_name_prefix="render")
+    return _executor
+
+def run_parallel(tasks):
+    """Runs a list of callables and returns their results in order.
+
+    The first task runs on the calling thread and the others on the shared
+    executor. A task that no worker has picked up yet by the time its result is
+    needed is cancelled and run on the calling thread instead, so tasks may call
+    run_parallel themselves without ever waiting on a queue that cannot drain.
+    Results (and raised exceptions) are the same as running the tasks serially.
+    """
+    executor = render_executor()
+    if executor is None or len(tasks) <= 1:
+        return [task() for task in tasks]
+    futures = [executor.submit(task) for task in tasks[1:]]
+    results = [tasks[0]()]
+    for task, future in zip(tasks[1:], futures):
+        results.append(task() if future.cancel() else future.result())
+    return results
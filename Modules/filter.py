@@ -1,6 +1,9 @@
-from Modules.Libs.libs import *
+from functools import lru_cache
 import numpy as np
 
+from Modules.utils import SAMPLE_RATE, MAX_FREQ, FILTER_BLOCK_SIZE, FILTER_CHUNK, FILTER_DESIGN_CACHE_SIZE, CUTOFF_STEP_CENTS, clamp
+from Modules.kernels import kernel
+
 class Filter:
     """Manages IIR digital filtering operations (Low-pass, High-pass, Band-pass)."""
     def __init__(self, filter_type, cutoff, resonance):
@@ -8,79 +11,163 @@ class Filter:
         self.cutoff = cutoff
         self.resonance = resonance # Q
 
-    def apply(self, data, order=2, cutoff_envelope=None):
-        """Apply filter to data.
+    def apply(self, data, order=2, cutoff_envelope=None, block_size=FILTER_BLOCK_SIZE, zi=None, out=None,
+              control_block=None, offset=0):
+        """Apply filter to data along its last axis (one row per voice for 2-D data).
 
         If cutoff_envelope is provided (array of per-sample cutoff frequencies), and
-        the filter type is Low-pass, a simple time-varying one-pole low-pass is applied
-        sample-by-sample. For other cases the static IIR butterworth implementation is used.
+        the filter type is Low-pass, a simple time-varying one-pole low-pass is applied.
+        Its coefficient is updated once every block_size samples (at most
+        FILTER_CHUNK) and the recursion is vectorized across blocks. block_size=1
+        reproduces the exact per-sample filter; the default of 8 stays within 1e-2
+        of it for full-scale input as long as envelope segments last 50 ms or more.
+        With control_block, cutoff_envelope is control rate instead: one cutoff
+        per control_block samples of the note (taken at the step centre), linearly
+        interpolated at the coefficient blocks; offset is the position of data[0]
+        in the note.
+        For other cases the static IIR butterworth implementation is used; its
+        designs are cached per (type, cutoff, Q, order, sample rate) and applied
+        as cascaded second-order sections, which stay stable at high Q. Both
+        recursions run on the active backend of Modules/kernels.
+
+        To filter a signal block by block, start from zi=initial_state(first_block)
+        and pass the returned state on with each block; (filtered, zf) is then
+        returned instead of just the filtered data. Blocks whose length is a
+        multiple of block_size give the same output as filtering in one go.
+
+        The output has the dtype of data (and is written into out, which may be
+        data itself, when given); the recursions run in float64 and the state
+        is kept in float64.
         """
         if self.type == "None":
-            return data
-
-        nyquist = SAMPLE_RATE / 2
-        Q = self.resonance
-        scaled_order = int(max(1, order * Q))
+            filtered = _store(data, data, out)
+            return filtered if zi is None else (filtered, zi)
 
         # Time-varying low-pass using one-pole filter (cheap and stable)
         if cutoff_envelope is not None and self.type == "Low-pass":
             # ensure envelope length matches data
             env = np.asarray(cutoff_envelope)
-            if env.shape[0] != data.shape[0]:
+            if control_block is None and env.shape[0] != data.shape[-1]:
                 # try to resample or truncate/pad to match
-                minlen = min(env.shape[0], data.shape[0])
-                if env.shape[0] < data.shape[0]:
+                minlen = min(env.shape[0], data.shape[-1])
+                if env.shape[0] < data.shape[-1]:
                     # pad last value
-                    env = np.concatenate([env, np.full(data.shape[0] - env.shape[0], env[-1])])
+                    env = np.concatenate([env, np.full(data.shape[-1] - env.shape[0], env[-1])])
                 else:
-                    env = env[:data.shape[0]]
-
-            # clamp
-            env = np.clip(env, 20.0, MAX_FREQ)
+                    env = env[:data.shape[-1]]
 
-            # compute per-sample alpha for one-pole filter
-            # alpha = 1 - exp(-2*pi*fc / fs)
-            alpha = 1.0 - np.exp(-2.0 * np.pi * (env / float(SAMPLE_RATE)))
-
-            # apply one-pole filter
-            y = np.zeros_like(data)
             if data.size == 0:
-                return data
-            y[0] = data[0]
-            for n in range(1, data.shape[0]):
-                a = alpha[n]
-                y[n] = y[n-1] + a * (data[n] - y[n-1])
-            return y
-
-        # fallback to static IIR filters
-        if self.type == "Low-pass":
-            cutoff = clamp(self.cutoff, 20, MAX_FREQ)
-            normal_cutoff = cutoff / nyquist
-            b, a = butter(scaled_order, normal_cutoff, btype='low', analog=False)
-            return lfilter(b, a, data)
-
-        elif self.type == "High-pass":
-            cutoff = clamp(self.cutoff, 20, MAX_FREQ)
-            normal_cutoff = cutoff / nyquist
-            b, a = butter(scaled_order, normal_cutoff, btype='high', analog=False)
-            return lfilter(b, a, data)
-
-        elif self.type == "Band-pass":
-            # Using the original code's approach: high_cutoff = cutoff * 1.5
-            low_cutoff = clamp(self.cutoff, 20, MAX_FREQ)
-            high_cutoff = clamp(low_cutoff * 1.5, low_cutoff, MAX_FREQ)
-
-            low = low_cutoff / nyquist
-            high = high_cutoff / nyquist
-
-            # Applying Q to bandwidth
-            bandwidth = high - low
-            scaled_bandwidth = bandwidth / Q
-
-            low_limit = clamp(low - scaled_bandwidth / 2, 0.01, 0.99)
-            high_limit = clamp(high + scaled_bandwidth / 2, low_limit, 0.99)
-
-            b, a = butter(scaled_order, [low_limit, high_limit], btype='band', analog=False)
-            return lfilter(b, a, data)
-
-        return data
\ No newline at end of file
+                filtered = _store(data, data, out)
+                return filtered if zi is None else (filtered, zi)
+
+            # one coefficient per block, taken from the cutoff at the block centre
+            # pole = 1 - alpha = exp(-2*pi*fc / fs)
+            block_size = int(clamp(block_size, 1, FILTER_CHUNK))
+            n_blocks = -(-data.shape[-1] // block_size)
+            centres = np.minimum(np.arange(n_blocks) * block_size + block_size // 2, data.shape[-1] - 1)
+            if control_block is None:
+                block_cutoff = env[centres]
+            else:
+                steps = np.arange(env.shape[0]) * control_block + control_block // 2
+                block_cutoff = np.interp(centres + offset, steps, env)
+            block_cutoff = np.clip(block_cutoff, 20.0, MAX_FREQ)
+            log_pole = -2.0 * np.pi * (block_cutoff / float(SAMPLE_RATE))
+
+            # apply one-pole filter (state starts at the first input sample)
+            if zi is None:
+                return _store(kernel("one_pole")(data, log_pole, block_size, data[..., 0]), data, out)
+            filtered = kernel("one_pole")(data, log_pole, block_size, zi)
+            return _store(filtered, data, out), filtered[..., -1].copy()
+
+        # fallback to static IIR filters, designed once per setting as second-order sections
+        if self.type in ("Low-pass", "High-pass", "Band-pass"):
+            sos = self._sos(order)
+            if zi is None:
+                return _store(kernel("sosfilt")(sos, data), data, out)
+            filtered, zf = kernel("sosfilt")(sos, data, zi)
+            return _store(filtered, data, out), zf
+
+        filtered = _store(data, data, out)
+        return filtered if zi is None else (filtered, zi)
+
+    def initial_state(self, data, order=2, cutoff_envelope=None):
+        """Returns the filter state to start a block-by-block run whose first block is data."""
+        if cutoff_envelope is not None and self.type == "Low-pass":
+            return np.array(data[..., 0], dtype=float)
+        if self.type in ("Low-pass", "High-pass", "Band-pass"):
+            # the static filters start at rest, as when filtering in one go
+            return np.zeros((self._sos(order).shape[0],) + data.shape[:-1] + (2,))
+        return np.zeros(data.shape[:-1])
+
+    def prepare(self, order=2):
+        """Designs (and caches) the static filter ahead of the first apply."""
+        if self.type in ("High-pass", "Band-pass"):
+            self._sos(order)
+
+    def _sos(self, order):
+        # clamp again after rounding: the nearest step to MAX_FREQ lies above Nyquist
+        cutoff = clamp(_quantize_cutoff(clamp(self.cutoff, 20, MAX_FREQ)), 20, MAX_FREQ)
+        return _design_sos(self.type, cutoff, self.resonance, order, SAMPLE_RATE)
+
+    @staticmethod
+    def design_cache_info():
+        """Returns hit/miss statistics of the static filter design cache."""
+        return _design_sos.cache_info()
+
+
+_signal = None
+
+def _scipy_signal():
+    """Returns scipy.signal, imported the first time a static filter is used."""
+    global _signal
+    if _signal is None:
+        import scipy.signal
+        _signal = scipy.signal
+    return _signal
+
+def _store(filtered, data, out):
+    """Returns filtered with the dtype of data, copied into out when given."""
+    if out is None:
+        return filtered.astype(data.dtype, copy=False)
+    if out is not filtered:
+        out[...] = filtered
+    return out
+
+def _quantize_cutoff(cutoff):
+    """Rounds a cutoff to the nearest CUTOFF_STEP_CENTS step so close knob positions share a design."""
+    steps = round(1200.0 / CUTOFF_STEP_CENTS * np.log2(cutoff / 20.0))
+    return float(20.0 * 2 ** (steps * CUTOFF_STEP_CENTS / 1200.0))
+
+@lru_cache(maxsize=FILTER_DESIGN_CACHE_SIZE)
+def _design_sos(filter_type, cutoff, Q, order, sample_rate):
+    """Designs the static Butterworth filter for a setting as second-order sections (shared, do not modify)."""
+    butter = _scipy_signal().butter
+    nyquist = sample_rate / 2
+    scaled_order = int(max(1, order * Q))
+
+    if filter_type == "Low-pass":
+        sos = butter(scaled_order, cutoff / nyquist, btype='low', output='sos')
+
+    elif filter_type == "High-pass":
+        sos = butter(scaled_order, cutoff / nyquist, btype='high', output='sos')
+
+    else:
+        # Using the original code's approach: high_cutoff = cutoff * 1.5
+        low_cutoff = cutoff
+        high_cutoff = clamp(low_cutoff * 1.5, low_cutoff, MAX_FREQ)
+
+        low = low_cutoff / nyquist
+        high = high_cutoff / nyquist
+
+        # Applying Q to bandwidth
+        bandwidth = high - low
+        scaled_bandwidth = bandwidth / Q
+
+        # the band keeps a minimum width, or low and high cutoffs clamp to the same edge
+        low_limit = clamp(low - scaled_bandwidth / 2, 0.01, 0.98)
+        high_limit = clamp(high + scaled_bandwidth / 2, low_limit + 0.01, 0.99)
+
+        sos = butter(scaled_order, [low_limit, high_limit], btype='band', output='sos')
+
+    return sos
+
@@ -0,0 +1,333 @@
+"""Registry of the hot inner-loop kernels, with interchangeable backends.
+
+Every kernel has a reference "numpy" implementation, defined here. Other
+backends (currently "numba", in Modules/kernels_numba.py, used when numba is
+installed) register their own versions of some or all kernels; a kernel the
+active backend lacks falls back to numpy. The backend is a runtime setting:
+
+    set_backend("numpy")        # or "numba", or "auto"
+    kernel("one_pole")(...)     # the active backend's version
+
+Kernels:
+    one_pole(data, log_pole, block_size, y_prev)    time-varying one-pole low-pass
+    sosfilt(sos, data, zi=None)                     cascaded biquads, as scipy.signal.sosfilt
+    table_lookup(flat, offsets, steps, phases, size, start, out)
+                                                    phase accumulation + wavetable read
+    linear_segments(out, lengths, starts, stops)    piecewise linear envelope
+    spectral_mac(spectra, history, out, product)    sum of bin-wise spectrum products
+
+check_parity() runs every kernel of every available backend against numpy,
+on inputs of the dtypes and layouts the render path passes; check_warmup()
+renders notes after prepare() and reports any kernel a JIT backend still had
+to compile. `python -m Modules.kernels` prints both and fails on a mismatch
+or a compile during the renders.
+"""
+import sys
+import threading
+import numpy as np
+
+from Modules.utils import FILTER_CHUNK, KERNEL_BACKEND, SAMPLE_DTYPE
+
+BACKENDS = ("numpy", "numba")
+
+_kernels = {} # kernel name -> {backend: function}
+_loaded = {"numpy"} # backends whose kernels are registered
+_missing = set() # backends that failed to load
+_lock = threading.Lock()
+_backend = None
+
+def register(name, backend="numpy"):
+    """Decorator: registers func as the backend's implementation of kernel name."""
+    def decorator(func):
+        _kernels.setdefault(name, {})[backend] = func
+        return func
+    return decorator
+
+def _load(backend):
+    """Imports a backend's module (registering its kernels). Returns False if it is unavailable."""
+    if backend in _loaded:
+        return True
+    if backend in _missing:
+        return False
+    with _lock:
+        try:
+            if backend == "numba":
+                from Modules import kernels_numba
+                kernels_numba.register_all(register)
+            else:
+                raise ImportError(f"unknown kernel backend {backend!r}")
+        except ImportError:
+            _missing.add(backend)
+            return False
+        _loaded.add(backend)
+        return True
+
+def available_backends():
+    """Returns the backends that can be used here."""
+    return [backend for backend in BACKENDS if _load(backend)]
+
+def set_backend(name):
+    """Selects the kernel backend: "numpy", "numba" or "auto" (numba when installed).
+
+    Raises ValueError for a backend that is unknown or cannot be loaded.
+    """
+    global _backend
+    if name == "auto":
+        name = "numba" if _load("numba") else "numpy"
+    elif name not in BACKENDS or not _load(name):
+        raise ValueError(f"kernel backend {name!r} is not available")
+    _backend = name
+
+def backend():
+    """Returns the name of the active backend."""
+    if _backend is None:
+        set_backend(KERNEL_BACKEND)
+    return _backend
+
+def kernel(name, backend_name=None):
+    """Returns the implementation of a kernel for a backend (the active one by default)."""
+    implementations = _kernels[name]
+    return implementations.get(backend_name or _backend or backend(), implementations["numpy"])
+
+def prepare():
+    """Runs every kernel of the active backend once on tiny inputs shaped like the
+    render path's (JIT backends compile here, not in the first audio callback)."""
+    if backend() == "numpy":
+        return
+    for name, inputs in _parity_inputs(np.random.default_rng(0), small=True).items():
+        kernel(name)(*inputs())
+    # a single voice's column tile is contiguous, which is a specialization of its own
+    flat, offsets, steps, phases, size, start, _ = _parity_inputs(np.random.default_rng(0), True)['table_lookup']()
+    kernel("table_lookup")(flat, offsets[:1], steps[:1], phases[:1], size, start,
+                           np.empty((1, 8), dtype=SAMPLE_DTYPE))
+
+
+@register("one_pole")
+def one_pole(data, log_pole, block_size, y_prev):
+    """Run y[n] = y[n-1] + alpha * (x[n] - y[n-1]) along the last axis of data.
+
+    log_pole holds log(1 - alpha) once per block of block_size samples. Blocks are
+    grouped into chunks of at most FILTER_CHUNK samples; inside a chunk the
+    recursion is solved in closed form (running pole product and cumulative sum),
+    so only the chunk-end states (zi) are carried from chunk to chunk in Python.
+    Chunks are kept short enough that the pole products cannot underflow.
+    """
+    n = data.shape[-1]
+    chunk = (FILTER_CHUNK // block_size) * block_size
+    n_chunks = -(-n // chunk)
+    size = n_chunks * chunk
+    used = log_pole.shape[0] * block_size
+
+    # per-sample coefficients; the padding past the end is a pass-through (pole 1)
+    gain_log = np.zeros(size)
+    gain_log[:used] = np.repeat(log_pole, block_size)
+    gain_log = gain_log.reshape(n_chunks, chunk)
+    drive = np.zeros(size)
+    drive[:used] = np.repeat(np.log(-np.expm1(log_pole)), block_size)
+    drive = drive.reshape(n_chunks, chunk)
+
+    # running pole product inside each chunk, and alpha divided by it
+    np.cumsum(gain_log, axis=-1, out=gain_log)
+    drive -= gain_log
+    np.exp(drive, out=drive)
+    powers = np.exp(gain_log, out=gain_log)
+
+    # zero-state response of every chunk at once
+    x = np.zeros(data.shape[:-1] + (size,))
+    x[..., :n] = data
+    x = x.reshape(data.shape[:-1] + (n_chunks, chunk))
+    x *= drive
+    zero_state = np.cumsum(x, axis=-1, out=x)
+    zero_state *= powers
+
+    # carry the filter state across chunk boundaries
+    rows = zero_state[..., -1].reshape(-1, n_chunks)
+    gains = powers[:, -1].tolist()
+    starts = np.asarray(y_prev, dtype=float).reshape(-1)
+    zi = np.empty_like(rows)
+    for r in range(rows.shape[0]):
+        state = float(starts[r])
+        row_states = []
+        for end, gain in zip(rows[r].tolist(), gains):
+            row_states.append(state)
+            state = end + gain * state
+        zi[r] = row_states
+    zi = zi.reshape(zero_state.shape[:-1])
+
+    zero_state += powers * zi[..., None]
+    return zero_state.reshape(data.shape[:-1] + (size,))[..., :n]
+
+@register("sosfilt")
+def sosfilt(sos, data, zi=None):
+    """Filters data along its last axis with second-order sections (scipy.signal.sosfilt).
+
+    Returns the filtered data in float64, or (filtered, zf) when zi is given.
+    """
+    from scipy.signal import sosfilt as scipy_sosfilt
+    return scipy_sosfilt(sos, data, axis=-1, zi=zi)
+
+@register("table_lookup")
+def table_lookup(flat, offsets, steps, phases, size, start, out):
+    """Fills out (rows, samples) with samples start.. of running wavetable oscillators.
+
+    Row r advances steps[r] cycles per sample from phases[r] (float64 phase
+    accumulation) and reads, with linear interpolation, the table of size + 1
+    samples at offsets[r] of the flattened table stack.
+    """
+    position = np.arange(start, start + out.shape[-1]) * steps[:, None]
+    position += phases[:, None]
+    position -= np.floor(position)
+    position *= size
+    index = position.astype(np.intp)
+    position -= index
+    frac = position.astype(flat.dtype)
+    index += offsets[:, None]
+
+    # gather from the flattened table stack so every row can use its own octave
+    left = flat[index]
+    right = flat[index + 1]
+    right -= left
+    right *= frac
+    right += left
+    out[...] = right
+    return out
+
+@register("linear_segments")
+def linear_segments(out, lengths, starts, stops):
+    """Fills out with consecutive straight lines, segment i running over lengths[i]
+    samples from starts[i] to stops[i] (a one-sample segment holds its start)."""
+    idx = 0
+    for length, start, stop in zip(lengths, starts, stops):
+        values = out[idx:idx + length]
+        values[...] = np.arange(length)
+        values *= (stop - start) / (length - 1) if length > 1 else 0.0
+        values += start
+        idx += length
+    return out
+
+@register("spectral_mac")
+def spectral_mac(spectra, history, out, product=None):
+    """Sets out to the sum over rows of spectra * history (two (partitions, bins)
+    complex arrays): the frequency-domain multiply-accumulate of partitioned convolution.
+    product is scratch of the same shape, so the audio thread need not allocate one."""
+    product = np.multiply(spectra, history, out=product)
+    return product.sum(axis=0, out=out)
+
+
+# Tolerance (max absolute difference from numpy) of every kernel
+PARITY_TOLERANCE = {'one_pole': 1e-9, 'sosfilt': 1e-9, 'table_lookup': 1e-5, 'linear_segments': 1e-6,
+                    'spectral_mac': 1e-4}
+
+def _parity_inputs(rng, small=False):
+    """Returns, per kernel, a function making fresh inputs (the kernels may write into
+    them) of the dtypes and layouts the render path passes."""
+    n = 64 if small else 4096
+
+    def one_pole_inputs():
+        data = rng.uniform(-1.0, 1.0, (3, n)).astype(SAMPLE_DTYPE)
+        log_pole = -2.0 * np.pi * rng.uniform(20.0, 20000.0, -(-n // 8)) / 44100.0
+        return data, log_pole, 8, data[:, 0].copy()
+
+    def sosfilt_inputs():
+        # two resonant sections with poles at radius 0.95
+        angles = np.array([0.1, 0.4])
+        sos = np.column_stack([np.full(2, 0.05), np.full(2, 0.1), np.full(2, 0.05), np.ones(2),
+                               -1.9 * np.cos(angles), np.full(2, 0.95 ** 2)])
+        return sos, rng.uniform(-1.0, 1.0, (3, n)).astype(SAMPLE_DTYPE), np.zeros((2, 3, 2))
+
+    def table_lookup_inputs():
+        size = 256
+        flat = rng.uniform(-1.0, 1.0, 3 * (size + 1)).astype(SAMPLE_DTYPE)
+        # wavetable.render writes column tiles of the note, broadcasting a scalar phase
+        return (flat, np.array([0, size + 1, 2 * (size + 1)]), rng.uniform(0.0, 0.4, 3),
+                np.broadcast_to(rng.uniform(0.0, 1.0), (3,)), size, 100,
+                np.empty((3, 2 * n), dtype=SAMPLE_DTYPE)[:, n:])
+
+    def linear_segments_inputs():
+        lengths = [n // 8, n // 4, 1, n // 2, n - n // 8 - n // 4 - 1 - n // 2]
+        return np.empty(n, dtype=SAMPLE_DTYPE), lengths, [0.0, 1.0, 0.3, 0.3, 0.0], [1.0, 0.3, 0.3, 0.0, 0.0]
+
+    def spectral_mac_inputs():
+        shape = (4 if small else 64, 33 if small else 513)
+        dtype = np.fft.rfft(np.zeros(2, dtype=SAMPLE_DTYPE)).dtype # as the convolver's spectra
+        spectra = (rng.standard_normal(shape) + 1j * rng.standard_normal(shape)).astype(dtype)
+        # the convolver's history is twice as long and passed as a window of rows
+        history = np.zeros((2 * shape[0], shape[1]), dtype=dtype)
+        history[1:shape[0] + 1] = rng.standard_normal(shape) + 1j * rng.standard_normal(shape)
+        return spectra, history[1:shape[0] + 1], np.empty(shape[1], dtype=dtype), np.empty(shape, dtype=dtype)
+
+    return {'one_pole': one_pole_inputs, 'sosfilt': sosfilt_inputs,
+            'table_lookup': table_lookup_inputs, 'linear_segments': linear_segments_inputs,
+            'spectral_mac': spectral_mac_inputs}
+
+def _as_array(result):
+    """The output array of a kernel result (the filtered data for sosfilt with zi)."""
+    return result[0] if isinstance(result, tuple) else result
+
+def check_parity(backends=None, seed=0):
+    """Runs every kernel of the given (default: all available) backends on random
+    inputs and compares it with numpy.
+
+    Returns a list of (kernel, backend, max_abs_difference, ok) tuples.
+    """
+    results = []
+    for name in _kernels:
+        inputs = _parity_inputs(np.random.default_rng(seed))[name]
+        reference = _as_array(kernel(name, "numpy")(*inputs()))
+        for backend_name in backends or available_backends():
+            if backend_name == "numpy" or not _load(backend_name):
+                continue
+            if backend_name not in _kernels[name]:
+                continue
+            inputs = _parity_inputs(np.random.default_rng(seed))[name]
+            result = _as_array(kernel(name, backend_name)(*inputs()))
+            difference = float(np.max(np.abs(np.asarray(result) - reference)))
+            results.append((name, backend_name, difference, difference <= PARITY_TOLERANCE[name]))
+    return results
+
+def check_warmup():
+    """Runs prepare(), then renders notes the ways the app does (every filter type,
+    one and several unison voices, one-shot and held, and a reverb block).
+
+    Returns {kernel loop: specializations compiled during the renders}, which is
+    empty when prepare() compiled everything the audio thread needs (and always
+    for the numpy backend).
+    """
+    if backend() == "numpy":
+        return {}
+    from Modules import kernels_numba
+    from Modules.wavetable import WAVETABLES
+    from Modules.offline import make_patch, note_state
+    from Modules.patch import compile_patch
+    from Modules.render import render_note, GatedNoteStream
+    from Modules.convolution import PartitionedConvolver, reverb_impulse_response
+    WAVETABLES.build_all()
+    prepare()
+    before = kernels_numba.signatures()
+    for filter_type in ("Low-pass", "High-pass", "Band-pass"):
+        for unison in (1, 3):
+            voice = {'unison': unison, 'filter_vars': {'filter_type': filter_type}}
+            patch = make_patch({'use_voice2': True, 'voice1_params': voice, 'voice2_params': voice})
+            state = note_state(patch, 60, 0.1)
+            render_note(state)
+            held = GatedNoteStream()
+            held.reset(compile_patch(state), np.array([state['freq']]))
+            held.next_block(FILTER_CHUNK)
+    PartitionedConvolver(reverb_impulse_response(0.1)).process(np.zeros(1024, dtype=SAMPLE_DTYPE))
+    after = kernels_numba.signatures()
+    return {name: after[name] - before[name] for name in after if after[name] != before[name]}
+
+def main():
+    print(f"available backends: {', '.join(available_backends())}; active: {backend()}")
+    results = check_parity()
+    for name, backend_name, difference, ok in results:
+        print(f"{name:<16} {backend_name:<8} max diff {difference:.3e}  {'ok' if ok else 'MISMATCH'}")
+    compiled = check_warmup()
+    for name, count in compiled.items():
+        print(f"{name:<16} compiled {count} specialization(s) after prepare()")
+    if not compiled:
+        print("warm-up: no kernel compiled during the renders")
+    return 0 if all(ok for *_, ok in results) and not compiled else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
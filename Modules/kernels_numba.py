@@ -0,0 +1,117 @@
+"""JIT-compiled (numba) backend of the inner-loop kernels.
+
+Importing this module raises ImportError when numba is not installed, which
+Modules/kernels treats as the backend being unavailable; otherwise the
+registry adds the kernels through register_all(). The recursions run as
+plain per-sample loops, compiled on first use (and cached on disk). The
+wrappers hand them float64, contiguous, writable inputs whatever the caller
+passes, so one specialization serves every render (only table_lookup writes
+into the caller's out, which is contiguous or a column tile).
+"""
+import numpy as np
+from numba import njit
+
+@njit(cache=True)
+def _one_pole_rows(rows, log_pole, block_size, starts, out):
+    n = rows.shape[1]
+    for r in range(rows.shape[0]):
+        y = starts[r]
+        for b in range(log_pole.shape[0]):
+            alpha = -np.expm1(log_pole[b])
+            for i in range(b * block_size, min((b + 1) * block_size, n)):
+                y += alpha * (rows[r, i] - y)
+                out[r, i] = y
+
+def one_pole(data, log_pole, block_size, y_prev):
+    rows = np.ascontiguousarray(data, dtype=float).reshape(-1, data.shape[-1])
+    starts = np.ascontiguousarray(y_prev, dtype=float).reshape(-1)
+    out = np.empty(rows.shape)
+    _one_pole_rows(rows, np.asarray(log_pole, dtype=float), block_size, starts, out)
+    return out.reshape(data.shape)
+
+@njit(cache=True)
+def _sosfilt_rows(sos, rows, zi, out):
+    for r in range(rows.shape[0]):
+        for i in range(rows.shape[1]):
+            x = rows[r, i]
+            for s in range(sos.shape[0]):
+                # transposed direct form II, as scipy
+                y = sos[s, 0] * x + zi[s, r, 0]
+                zi[s, r, 0] = sos[s, 1] * x - sos[s, 4] * y + zi[s, r, 1]
+                zi[s, r, 1] = sos[s, 2] * x - sos[s, 5] * y
+                x = y
+            out[r, i] = x
+
+def sosfilt(sos, data, zi=None):
+    rows = np.ascontiguousarray(data, dtype=float).reshape(-1, data.shape[-1])
+    sos = np.asarray(sos, dtype=float)
+    sos = sos / sos[:, 3:4]
+    state = np.zeros((sos.shape[0], rows.shape[0], 2)) if zi is None else \
+        np.array(zi, dtype=float).reshape(sos.shape[0], rows.shape[0], 2)
+    out = np.empty(rows.shape)
+    _sosfilt_rows(sos, rows, state, out)
+    out = out.reshape(data.shape)
+    if zi is None:
+        return out
+    return out, state.reshape(np.shape(zi))
+
+@njit(cache=True)
+def _table_lookup_rows(flat, offsets, steps, phases, size, start, out):
+    for r in range(out.shape[0]):
+        for i in range(out.shape[1]):
+            position = (start + i) * steps[r] + phases[r]
+            position = (position - np.floor(position)) * size
+            index = int(position)
+            frac = position - index
+            left = flat[offsets[r] + index]
+            out[r, i] = left + (flat[offsets[r] + index + 1] - left) * frac
+
+def table_lookup(flat, offsets, steps, phases, size, start, out):
+    # phases may be a read-only broadcast view, which numba types separately: copy it
+    _table_lookup_rows(flat, np.ascontiguousarray(offsets, dtype=np.intp), np.ascontiguousarray(steps, dtype=float),
+                       np.array(phases, dtype=float), size, start, out)
+    return out
+
+@njit(cache=True)
+def _linear_segments(out, lengths, starts, stops):
+    idx = 0
+    for s in range(lengths.shape[0]):
+        length = lengths[s]
+        slope = (stops[s] - starts[s]) / (length - 1) if length > 1 else 0.0
+        for i in range(length):
+            out[idx + i] = starts[s] + i * slope
+        idx += length
+
+def linear_segments(out, lengths, starts, stops):
+    _linear_segments(out, np.asarray(lengths, dtype=np.int64), np.asarray(starts, dtype=float),
+                     np.asarray(stops, dtype=float))
+    return out
+
+@njit(cache=True)
+def _spectral_mac(spectra, history, out):
+    out[:] = 0
+    for j in range(spectra.shape[0]):
+        for k in range(spectra.shape[1]):
+            out[k] += spectra[j, k] * history[j, k]
+
+def spectral_mac(spectra, history, out, product=None):
+    _spectral_mac(spectra, history, out) # accumulates in place, no scratch needed
+    return out
+
+KERNELS = {
+    'one_pole': one_pole,
+    'sosfilt': sosfilt,
+    'table_lookup': table_lookup,
+    'linear_segments': linear_segments,
+    'spectral_mac': spectral_mac,
+}
+
+def signatures():
+    """Returns how many specializations each compiled loop holds."""
+    return {func.__name__: len(func.signatures) for func in
+            (_one_pole_rows, _sosfilt_rows, _table_lookup_rows, _linear_segments, _spectral_mac)}
+
+def register_all(register):
+    """Registers every kernel of this backend through a registry's register decorator."""
+    for name, func in KERNELS.items():
+        register(name, "numba")(func)
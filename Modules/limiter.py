@@ -0,0 +1,115 @@
+import numpy as np
+
+from Modules.utils import SAMPLE_RATE
+
+LIMITER_LOOKAHEAD_MS = 2.0 # Delay of the master bus; peaks are seen this far ahead
+LIMITER_RELEASE_MS = 100.0 # Time for the gain to recover by 20 dB
+LIMITER_CEILING = 0.98 # Highest absolute sample value let through
+
+class Limiter:
+    """Look-ahead peak limiter with master gain, run block by block on the mixed bus.
+
+    The output is delayed by lookahead_ms. For every sample the gain needed to
+    keep it under the ceiling is computed (in log units), held at its minimum
+    over the look-ahead window, averaged over the window so the gain ramps
+    down smoothly before a peak arrives, and allowed to rise again at a fixed
+    rate (release_ms per 20 dB). Every step is vectorized over the block; the
+    release recursion G[n] = min(A[n], G[n-1] + c) is solved with a running
+    minimum. Only the last look-ahead samples and gains are carried between
+    blocks, in preallocated work buffers.
+    """
+
+    def __init__(self, samplerate=SAMPLE_RATE, lookahead_ms=LIMITER_LOOKAHEAD_MS,
+                 release_ms=LIMITER_RELEASE_MS, ceiling=LIMITER_CEILING, master_gain=1.0):
+        self.lookahead = max(1, int(round(samplerate * lookahead_ms / 1000.0)))
+        self.release_step = np.log(10.0) / max(1.0, samplerate * release_ms / 1000.0)
+        self.log_ceiling = float(np.log(ceiling))
+        self.master_gain = master_gain
+        self.gain_db = 0.0 # gain applied at the end of the last block
+        self.reset()
+
+    @property
+    def latency(self):
+        """Delay of the limiter in samples."""
+        return self.lookahead
+
+    def reset(self):
+        L = self.lookahead
+        self._samples = np.zeros(L) # last L input samples (not yet output)
+        self._required = np.zeros(L) # their required log gains
+        self._held = np.zeros(L - 1) # last L - 1 held gains, for the smoothing average
+        self._gain = 0.0 # log gain of the last output sample
+        self._size = 0
+        self._grow(0)
+
+    def _grow(self, frames):
+        size = frames + self.lookahead
+        if size > self._size:
+            self._size = size
+            self._x = np.empty(size)
+            self._r = np.empty(size)
+            self._h = np.empty(size + self.lookahead)
+            self._sums = np.empty(size)
+            self._smooth = np.empty(size)
+            self._ramp = np.arange(size, dtype=float) * self.release_step
+
+    def process(self, block, out=None):
+        """Limits one block of the bus (written to out, which may be block itself)."""
+        B = block.shape[0]
+        if B == 0:
+            return block if out is None else out
+        L = self.lookahead
+        self._grow(B)
+        if out is None:
+            out = np.empty_like(block)
+
+        # input with the carried samples in front: x[i] is output at position i
+        x = self._x[:L + B]
+        x[:L] = self._samples
+        np.multiply(block, self.master_gain, out=x[L:])
+
+        # required log gain per sample: min(0, log(ceiling / |x|))
+        r = self._r[:L + B]
+        r[:L] = self._required
+        required = r[L:]
+        np.abs(x[L:], out=required)
+        np.maximum(required, 1e-12, out=required)
+        np.log(required, out=required)
+        np.subtract(self.log_ceiling, required, out=required)
+        np.minimum(required, 0.0, out=required)
+
+        # hold: minimum over the window [i, i + L] (doubling, O(B log L))
+        h = self._h[L - 1:L - 1 + L + B]
+        h[:] = r
+        span = 1
+        while span * 2 <= L + 1:
+            np.minimum(h[:-span], h[span:], out=h[:-span])
+            span *= 2
+        np.minimum(h[:B], h[L + 1 - span:L + 1 - span + B], out=h[:B])
+
+        # smooth: average of the last L held values (the carried L - 1 come first)
+        held = self._h[:L - 1 + B]
+        held[:L - 1] = self._held
+        sums = np.cumsum(held, out=self._sums[:L - 1 + B])
+        smooth = self._smooth[:B]
+        smooth[0] = sums[L - 1]
+        np.subtract(sums[L:], sums[:B - 1], out=smooth[1:])
+        smooth /= L
+        self._held[:] = held[B:B + L - 1]
+
+        # release: G[n] = min(A[n], G[n-1] + c) = c n + min(G[-1] + c, running min of A[k] - c k)
+        ramp = self._ramp[:B]
+        smooth -= ramp
+        np.minimum.accumulate(smooth, out=smooth)
+        np.minimum(smooth, self._gain + self.release_step, out=smooth)
+        smooth += ramp
+        self._gain = float(smooth[-1])
+        self.gain_db = self._gain * 20.0 / float(np.log(10.0))
+
+        # apply to the delayed samples and carry the rest
+        np.exp(smooth, out=smooth)
+        smooth *= x[:B]
+        out[...] = smooth
+        self._samples[:] = x[B:]
+        self._required[:] = r[B:]
+        return out
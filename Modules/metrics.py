@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("synth.metrics")
+
+# Upper bucket bounds (in ms) of the latency histograms; the last bucket is open
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+class Counter:
+    """A monotonically increasing count."""
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Histogram:
+    """Fixed-bucket histogram with count, sum, min and max.
+
+    Recording is a bisection and a few additions, so it is cheap enough for the
+    audio callback; no lock is taken, readers may see a sample half recorded.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        lo, hi = 0, len(self.buckets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if value <= self.buckets[mid]:
+                hi = mid
+            else:
+                lo = mid + 1
+        self.counts[lo] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (max for the open bucket)."""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min, 'max': self.max,
+            'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(bound) for bound in self.buckets] + ['inf'], self.counts)),
+        }
+
+
+class NoteTimeline:
+    """Timestamps (time.perf_counter) of one note from key press to its last sample."""
+
+    def __init__(self, note=None):
+        self.note = note
+        self.press = time.perf_counter()
+        self.render_start = None
+        self.render_end = None
+        self.first_callback = None
+        self.last_sample = None
+
+    def mark(self, event):
+        setattr(self, event, time.perf_counter())
+
+
+class Metrics:
+    """In-process registry of named counters and histograms."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock() # only taken when a new name is registered
+
+    def counter(self, name):
+        counter = self.counters.get(name)
+        if counter is None:
+            with self._lock:
+                counter = self.counters.setdefault(name, Counter())
+        return counter
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS_MS):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram(buckets))
+        return histogram
+
+    def record_stream_status(self, stream, status):
+        """Counts the underflow/overflow flags of a sounddevice callback status for a stream."""
+        for flag in ('output_underflow', 'output_overflow', 'input_underflow', 'input_overflow', 'priming_output'):
+            if getattr(status, flag, False):
+                self.counter(f"{stream}.{flag}").inc()
+
+    def record_callback(self, stream, duration, deadline):
+        """Records how long a callback took against the time one buffer lasts (both in seconds)."""
+        self.histogram(f"{stream}.callback_ms").record(duration * 1e3)
+        self.histogram(f"{stream}.callback_load", buckets=(0.1, 0.25, 0.5, 0.75, 0.9, 1.0, 1.5, 2.0)).record(
+            duration / deadline if deadline > 0 else 0.0)
+        if duration > deadline:
+            self.counter(f"{stream}.missed_deadlines").inc()
+
+    def record_note(self, timeline):
+        """Turns a finished note timeline into latency histograms (in ms, relative to the press)."""
+        for event in ('render_start', 'render_end', 'first_callback', 'last_sample'):
+            stamp = getattr(timeline, event)
+            if stamp is not None:
+                self.histogram(f"note.press_to_{event}_ms").record((stamp - timeline.press) * 1e3)
+        if timeline.render_start is not None and timeline.render_end is not None:
+            self.histogram("note.render_ms").record((timeline.render_end - timeline.render_start) * 1e3)
+        self.counter("note.finished").inc()
+
+    def snapshot(self):
+        """Returns every counter and histogram as plain (JSON ready) values."""
+        return {
+            'time': time.time(),
+            'counters': {name: counter.value for name, counter in sorted(self.counters.items())},
+            'histograms': {name: histogram.snapshot() for name, histogram in sorted(self.histograms.items())},
+        }
+
+    def dump(self, path):
+        """Writes a snapshot as JSON (written to a temporary file, then renamed into place)."""
+        temp = path + ".tmp"
+        with open(temp, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(temp, path)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+class MetricsReporter:
+    """Logs a short metrics summary, and optionally dumps the full snapshot as JSON,
+    every interval seconds from a daemon thread."""
+
+    def __init__(self, metrics, interval=10.0, path=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.path = path
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.report()
+
+    def report(self):
+        snapshot = self.metrics.snapshot()
+        counters = ", ".join(f"{name}={value}" for name, value in snapshot['counters'].items())
+        logger.info("metrics: %s", counters or "no events")
+        for name, histogram in snapshot['histograms'].items():
+            if histogram['count']:
+                logger.info("metrics: %s n=%d mean=%.3f p99<=%s max=%.3f", name, histogram['count'],
+                            histogram['mean'], histogram['p99'], histogram['max'])
+        if self.path:
+            try:
+                self.metrics.dump(self.path)
+            except OSError as error:
+                logger.warning("metrics dump to %s failed: %s", self.path, error)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+# Shared by the engine, the render path and the GUI
+METRICS = Metrics()
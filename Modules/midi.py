@@ -0,0 +1,156 @@
+"""Minimal MIDI input: a Standard MIDI File reader and a virtual port stand-in.
+
+Only what the synth plays is decoded: note on/off (a note-on with velocity 0
+is a note-off) and control changes (as "ccN" param events with values
+0..1). Tempo changes are honoured; every other event is skipped.
+"""
+import struct
+
+from Modules.utils import SAMPLE_RATE
+from Modules.scheduler import Event
+
+DEFAULT_TEMPO = 500000 # microseconds per quarter note (120 bpm) until a tempo event
+
+def _read_varlen(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+def message_event(status, data1, data2, frame=0):
+    """Returns the Event for a channel message, or None for one the synth ignores."""
+    kind = status & 0xF0
+    if kind == 0x90 and data2 > 0:
+        return Event(frame, "note_on", data1, data2 / 127.0)
+    if kind == 0x80 or kind == 0x90:
+        return Event(frame, "note_off", data1, 0.0)
+    if kind == 0xB0:
+        return Event(frame, "param", name=f"cc{data1}", value=data2 / 127.0)
+    return None
+
+def _read_track(data):
+    """Yields (tick, status, data1, data2) channel messages and (tick, 'tempo', value)
+    of one track chunk."""
+    pos, tick, status = 0, 0, None
+    while pos < len(data):
+        delta, pos = _read_varlen(data, pos)
+        tick += delta
+        byte = data[pos]
+        if byte == 0xFF: # meta event
+            meta = data[pos + 1]
+            length, pos = _read_varlen(data, pos + 2)
+            if meta == 0x51 and length == 3:
+                yield tick, 'tempo', int.from_bytes(data[pos:pos + 3], 'big'), None
+            elif meta == 0x2F:
+                return
+            pos += length
+        elif byte in (0xF0, 0xF7): # sysex
+            length, pos = _read_varlen(data, pos + 1)
+            pos += length
+        else:
+            if byte & 0x80:
+                status = byte
+                pos += 1
+            elif status is None:
+                raise ValueError("MIDI data byte without a status")
+            size = 1 if status & 0xF0 in (0xC0, 0xD0) else 2
+            values = data[pos:pos + size]
+            pos += size
+            yield tick, status, values[0], values[1] if size == 2 else 0
+
+def read_midi(path, samplerate=SAMPLE_RATE):
+    """Reads a Standard MIDI File (format 0 or 1) into a time-ordered list of
+    Events with frames counted from the start of the file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'MThd':
+        raise ValueError(f"{path} is not a MIDI file")
+    header_length = struct.unpack('>I', data[4:8])[0]
+    _, n_tracks, division = struct.unpack('>HHH', data[8:14])
+    if division & 0x8000:
+        # SMPTE time: frames per second and ticks per frame
+        seconds_per_tick = 1.0 / ((256 - (division >> 8)) * (division & 0xFF))
+    else:
+        seconds_per_tick = None
+
+    messages = []
+    pos = 8 + header_length
+    for _ in range(n_tracks):
+        chunk, length = data[pos:pos + 4], struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        if chunk == b'MTrk':
+            messages.extend(_read_track(data[pos + 8:pos + 8 + length]))
+        pos += 8 + length
+    # tempo events come first at equal ticks so they apply to their own tick
+    messages.sort(key=lambda message: (message[0], message[1] != 'tempo'))
+
+    events = []
+    tempo, last_tick, seconds = DEFAULT_TEMPO, 0, 0.0
+    for tick, status, data1, data2 in messages:
+        if seconds_per_tick is None:
+            seconds += (tick - last_tick) * tempo / 1e6 / division
+        else:
+            seconds += (tick - last_tick) * seconds_per_tick
+        last_tick = tick
+        if status == 'tempo':
+            tempo = data1
+            continue
+        event = message_event(status, data1, data2, int(round(seconds * samplerate)))
+        if event is not None:
+            events.append(event)
+    return events
+
+def events_to_notes(events, samplerate=SAMPLE_RATE):
+    """Pairs note-ons with their note-offs into offline renderer notes
+    ({"pitch", "start", "duration", "velocity"}). Notes left on end at the last event."""
+    notes, held = [], {}
+    last = max((event.frame for event in events), default=0)
+    for event in events:
+        if event.kind == "note_on":
+            held.setdefault(event.note, []).append((event.frame, event.velocity))
+        elif event.kind == "note_off" and held.get(event.note):
+            start, velocity = held[event.note].pop(0)
+            notes.append({'pitch': event.note, 'start': start / samplerate,
+                          'duration': max(event.frame - start, 1) / samplerate, 'velocity': velocity})
+    for note, starts in held.items():
+        for start, velocity in starts:
+            notes.append({'pitch': note, 'start': start / samplerate,
+                          'duration': max(last - start, 1) / samplerate, 'velocity': velocity})
+    return sorted(notes, key=lambda note: note['start'])
+
+
+class VirtualPort:
+    """Stand-in for a MIDI input port feeding an EventScheduler.
+
+    Messages can be sent from any thread (GUI callbacks, a test script, a real
+    MIDI backend); each one is stamped when it arrives, so it plays a fixed
+    latency later at its exact sample offset.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.received = 0
+
+    def send(self, message, when=None, patch=None, timeline=None):
+        """Sends a raw (status, data1, data2) channel message that arrived at
+        scheduler clock time when (now by default). A note-on plays patch (if
+        given) and traces timeline (a NoteTimeline, if given)."""
+        status, data1, data2 = (list(message) + [0, 0])[:3]
+        event = message_event(status, data1, data2, self.scheduler.stamp(when))
+        if event is None:
+            return
+        if event.kind == "note_on" and (patch is not None or timeline is not None):
+            event = Event(event.frame, event.kind, event.note, event.velocity, value=patch, timeline=timeline)
+        self.received += 1
+        self.scheduler.post(event)
+
+    def note_on(self, note, velocity=100, channel=0, patch=None, timeline=None):
+        self.send((0x90 | channel, note, velocity), patch=patch, timeline=timeline)
+
+    def note_off(self, note, channel=0):
+        self.send((0x80 | channel, note, 0))
+
+    def control_change(self, control, value, channel=0):
+        self.send((0xB0 | channel, control, value))
@@ -0,0 +1,125 @@
+import numpy as np
+
+from Modules.utils import SAMPLE_RATE, CONTROL_BLOCK
+from Modules.adsr import ADSR
+
+LFO_SHAPES = ("Sine", "Triangle", "Square", "Sawtooth")
+# What a route can modulate: a voice's filter cutoff (amount in octaves) or the
+# note's amplitude (amount as a fraction of the amp envelope)
+MOD_TARGETS = ("voice1.cutoff", "voice2.cutoff", "amp")
+
+def control_positions(n_samples, block=CONTROL_BLOCK):
+    """Returns the sample at the centre of every control step of a note (the last
+    step may run past the end of the note)."""
+    return np.arange(-(-n_samples // block)) * block + block // 2
+
+def to_audio_rate(control, n_samples, block=CONTROL_BLOCK):
+    """Linearly interpolates control-rate values to one value per sample."""
+    return np.interp(np.arange(n_samples), control_positions(n_samples, block), control)
+
+
+class EnvelopeSource:
+    """An ADSR envelope as a modulation source (0..1 over the note)."""
+
+    def __init__(self, attack, decay, sustain, release):
+        self.adsr = ADSR(attack, decay, sustain, release)
+
+    def values(self, n_samples, block=CONTROL_BLOCK):
+        return self.at(control_positions(n_samples, block), n_samples)
+
+    def at(self, positions, n_samples):
+        """Values at sample positions of a note lasting n_samples."""
+        return self.adsr.at(positions, n_samples)
+
+
+class LFO:
+    """A low-frequency oscillator (-1..1) that restarts with every note."""
+
+    def __init__(self, rate=5.0, shape="Sine", phase=0.0):
+        if shape not in LFO_SHAPES:
+            raise ValueError(f"unknown LFO shape {shape!r}")
+        self.rate = rate # Hz
+        self.shape = shape
+        self.phase = phase # in cycles, at the start of the note
+
+    def values(self, n_samples, block=CONTROL_BLOCK):
+        return self.at(control_positions(n_samples, block), n_samples)
+
+    def at(self, positions, n_samples=None):
+        """Values at sample positions from the note start (the note length does not matter)."""
+        cycles = np.asarray(positions) * (self.rate / SAMPLE_RATE) + self.phase
+        cycles -= np.floor(cycles)
+        if self.shape == "Sine":
+            return np.sin(2 * np.pi * cycles)
+        elif self.shape == "Triangle":
+            return 1.0 - 4.0 * np.abs(cycles - 0.5)
+        elif self.shape == "Square":
+            return np.where(cycles < 0.5, 1.0, -1.0)
+        return 2.0 * cycles - 1.0
+
+
+class ModMatrix:
+    """Named modulation sources and the routes from them to MOD_TARGETS.
+
+    Everything is evaluated at the control rate (one value per CONTROL_BLOCK
+    samples) when a patch is compiled; the render path only interpolates the
+    summed result where its kernel needs finer steps.
+    """
+
+    def __init__(self, sources=None, routes=None):
+        self.sources = dict(sources or {})
+        self.routes = [] # (source, target, amount)
+        for route in routes or []:
+            self.connect(*route)
+
+    def add_source(self, name, source):
+        self.sources[name] = source
+
+    def connect(self, source, target, amount=1.0):
+        if source not in self.sources:
+            raise ValueError(f"unknown modulation source {source!r}")
+        if target not in MOD_TARGETS:
+            raise ValueError(f"unknown modulation target {target!r}")
+        self.routes.append((source, target, float(amount)))
+
+    def targets(self):
+        """Returns the targets with at least one (non-zero) route."""
+        return {target for _, target, amount in self.routes if amount}
+
+    def evaluate(self, n_samples, block=CONTROL_BLOCK):
+        """Returns {target: control-rate sum of its routes} for a note of n_samples.
+
+        Each source is evaluated once, however many routes it feeds.
+        """
+        return self.evaluate_at(control_positions(n_samples, block), n_samples)
+
+    def evaluate_at(self, positions, n_samples):
+        """Like evaluate, at any sample positions (held notes evaluate block by
+        block; their envelope sources still run over n_samples)."""
+        values = {}
+        result = {}
+        for source, target, amount in self.routes:
+            if not amount:
+                continue
+            if source not in values:
+                values[source] = self.sources[source].at(positions, n_samples)
+            if target in result:
+                result[target] = result[target] + amount * values[source]
+            else:
+                result[target] = amount * values[source]
+        return result
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Builds a matrix from the 'modulation' entry of a state dict:
+        {'lfos': {name: {'rate', 'shape', 'phase'}}, 'envelopes': {name: adsr_vars},
+        'routes': [{'source', 'target', 'amount'}]} (every key optional)."""
+        settings = settings or {}
+        matrix = cls()
+        for name, lfo in settings.get('lfos', {}).items():
+            matrix.add_source(name, LFO(**lfo))
+        for name, adsr_vars in settings.get('envelopes', {}).items():
+            matrix.add_source(name, EnvelopeSource(**adsr_vars))
+        for route in settings.get('routes', []):
+            matrix.connect(route['source'], route['target'], route.get('amount', 1.0))
+        return matrix
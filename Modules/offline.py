@@ -0,0 +1,181 @@
+"""Headless offline renderer: renders note lists to WAV or NumPy files without the GUI.
+
+Usage:
+    python -m Modules.offline notes.json out.wav [--workers N] [--stems]
+    python -m Modules.offline song.mid out.wav [--workers N]
+        [--ir Room|Hall|Cathedral|response.wav] [--wet 0.3] [--dry 1.0]
+
+The JSON file holds an optional "patches" mapping of name -> patch and a "notes"
+list of {"pitch", "start", "duration", "patch", "velocity", "stem"} entries
+(only "pitch" is required). Patches only need the values that differ from
+DEFAULT_PATCH. With --stems the output is a directory with one file per stem.
+A Standard MIDI File can be given instead; its notes play with DEFAULT_PATCH.
+--ir runs the mix (or every stem) through the convolution effect, tail included.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import copy
+import json
+import os
+import numpy as np
+
+from Modules.utils import note_to_frequency, SAMPLE_RATE, SAMPLE_DTYPE
+from Modules.render import render_note
+from Modules.executor import set_render_threads
+from Modules.midi import read_midi, events_to_notes
+from Modules.convolution import convolve, preset_impulse_response
+
+# Same values as the GUI starts with
+DEFAULT_PATCH = {
+    'voice1_params': {
+        'waveform': "Sawtooth", 'detune': 0.0, 'unison': 1,
+        'adsr_vars': {'attack': 0.0, 'decay': 0.25, 'sustain': 0.0, 'release': 0.13},
+        'filter_vars': {'filter_type': "Low-pass", 'cutoff': 2000.0, 'resonance': 1.0}
+    },
+    'use_voice2': False,
+    'voice2_params': {
+        'waveform': "Sawtooth", 'detune': 0.0, 'unison': 1,
+        'adsr_vars': {'attack': 0.0, 'decay': 0.1, 'sustain': 0.0, 'release': 0.1},
+        'filter_vars': {'filter_type': "Low-pass", 'cutoff': 2000.0, 'resonance': 1.0}
+    },
+    'amp_adsr_vars': {'attack': 0.0, 'decay': 0.1, 'sustain': 0.0, 'release': 0.1},
+    'mix_level': 0.5
+}
+
+def make_patch(overrides=None):
+    """Returns DEFAULT_PATCH with the (possibly nested, partial) overrides applied."""
+    patch = copy.deepcopy(DEFAULT_PATCH)
+
+    def merge(target, values):
+        for key, value in values.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                merge(target[key], value)
+            else:
+                target[key] = value
+
+    merge(patch, overrides or {})
+    return patch
+
+def note_state(patch, pitch, duration):
+    """Builds the note state dict the render chain expects, as SynthApp.play_note does."""
+    state = copy.deepcopy(patch)
+    state.update({'note': pitch, 'duration': duration, 'freq': note_to_frequency(pitch)})
+    return state
+
+def _render_event(state):
+    """Worker entry point: renders one note state (runs in a pool process)."""
+    return render_note(state)
+
+def _states(notes, patches):
+    states = []
+    for note in notes:
+        patch = note.get('patch', {})
+        if isinstance(patch, str):
+            patch = patches[patch]
+        states.append(note_state(make_patch(patch), note['pitch'], note.get('duration', 0.5)))
+    return states
+
+def _render_all(states, workers):
+    if (workers is not None and workers <= 1) or len(states) <= 1:
+        return [_render_event(state) for state in states]
+    # the processes already use every core, so each one renders serially
+    with ProcessPoolExecutor(max_workers=workers, initializer=set_render_threads, initargs=(1,)) as pool:
+        chunksize = max(1, len(states) // (4 * (workers or os.cpu_count() or 1)))
+        return list(pool.map(_render_event, states, chunksize=chunksize))
+
+def _mix(notes, waves):
+    """Places every rendered note at its start time and sums them. Scales down only if it would clip."""
+    length = 0
+    for note, wave in zip(notes, waves):
+        length = max(length, int(round(note.get('start', 0.0) * SAMPLE_RATE)) + len(wave))
+    mix = np.zeros(length, dtype=SAMPLE_DTYPE)
+    for note, wave in zip(notes, waves):
+        start = int(round(note.get('start', 0.0) * SAMPLE_RATE))
+        mix[start:start + len(wave)] += note.get('velocity', 1.0) * wave
+    peak = np.max(np.abs(mix)) if length else 0.0
+    return mix / peak if peak > 1.0 else mix
+
+def render_sequence(notes, patches=None, workers=None):
+    """Renders a list of notes into one mixed wave.
+
+    Independent notes are rendered across a process pool (workers=None uses one
+    process per core, workers=1 renders in this process).
+    """
+    waves = _render_all(_states(notes, patches or {}), workers)
+    return _mix(notes, waves)
+
+def render_stems(notes, patches=None, workers=None):
+    """Renders notes grouped by their "stem" key. Returns {stem: wave}.
+
+    All notes of all stems share one process pool.
+    """
+    waves = _render_all(_states(notes, patches or {}), workers)
+    stems = {}
+    for note, wave in zip(notes, waves):
+        stem_notes, stem_waves = stems.setdefault(note.get('stem', 'main'), ([], []))
+        stem_notes.append(note)
+        stem_waves.append(wave)
+    return {name: _mix(stem_notes, stem_waves) for name, (stem_notes, stem_waves) in stems.items()}
+
+def apply_impulse_response(wave, ir, wet=1.0, dry=0.0):
+    """Convolves a rendered wave with an impulse response. Scales down only if it would clip."""
+    wave = convolve(wave, ir, wet, dry)
+    peak = np.max(np.abs(wave)) if len(wave) else 0.0
+    return wave / peak if peak > 1.0 else wave
+
+def stem_files(names):
+    """Maps stem names to the .wav file names they are written to inside the
+    output directory. Raises ValueError for a name that is a path (or empty)
+    and for names that would share a file."""
+    files = {}
+    for name in names:
+        base = str(name)
+        if base in ('', '.', '..') or os.path.basename(base) != base or (os.altsep and os.altsep in base):
+            raise ValueError(f"invalid stem name {name!r}: stem names cannot contain path separators")
+        files[name] = base + '.wav'
+    # case-insensitive file systems would merge stems differing only in case
+    if len({path.lower() for path in files.values()}) < len(files):
+        raise ValueError("stem names must be unique (ignoring case)")
+    return files
+
+def write_audio(path, wave):
+    """Writes a wave as .npy (in its SAMPLE_DTYPE) or as a 32-bit float WAV file."""
+    if path.endswith('.npy'):
+        np.save(path, wave)
+    else:
+        from scipy.io import wavfile
+        wavfile.write(path, SAMPLE_RATE, np.asarray(wave, dtype=np.float32))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render note lists to audio files without the GUI.")
+    parser.add_argument('notes', help="JSON file with \"notes\" and optional \"patches\", or a .mid file")
+    parser.add_argument('output', help="output .wav/.npy file (a directory with --stems)")
+    parser.add_argument('--workers', type=int, default=None, help="render processes (default: one per core)")
+    parser.add_argument('--stems', action='store_true', help="write one file per stem into the output directory")
+    parser.add_argument('--ir', help="convolve the output with a reverb preset or an impulse response file")
+    parser.add_argument('--wet', type=float, default=0.3, help="level of the convolved signal (with --ir)")
+    parser.add_argument('--dry', type=float, default=1.0, help="level of the direct signal (with --ir)")
+    args = parser.parse_args(argv)
+    ir = preset_impulse_response(args.ir) if args.ir else None
+
+    def finish(wave):
+        return wave if ir is None else apply_impulse_response(wave, ir, args.wet, args.dry)
+
+    if args.notes.lower().endswith(('.mid', '.midi')):
+        spec = {'notes': events_to_notes(read_midi(args.notes))}
+    else:
+        with open(args.notes) as f:
+            spec = json.load(f)
+    notes = spec['notes'] if isinstance(spec, dict) else spec
+    patches = spec.get('patches', {}) if isinstance(spec, dict) else {}
+
+    if args.stems:
+        files = stem_files({note.get('stem', 'main') for note in notes})
+        os.makedirs(args.output, exist_ok=True)
+        for name, wave in render_stems(notes, patches, args.workers).items():
+            write_audio(os.path.join(args.output, files[name]), finish(wave))
+    else:
+        write_audio(args.output, finish(render_sequence(notes, patches, args.workers)))
+
+if __name__ == "__main__":
+    main()
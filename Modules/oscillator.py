@@ -1,15 +1,56 @@
-from Modules.Libs.libs import *
+import numpy as np
+
+from Modules.utils import SAMPLE_RATE, SAMPLE_DTYPE
+from Modules.wavetable import WAVETABLES
 
 class Oscillator:
-    """Generates base waveforms (Sine, Square, or Sawtooth)."""
+    """Generates base waveforms (Sine, Square, or Sawtooth).
+
+    In "wavetable" mode (the default) every preset is read from precomputed
+    band-limited tables; "naive" mode sums the aliasing shapes directly.
+    """
     
-    def __init__(self, waveform):
+    def __init__(self, waveform, mode="wavetable"):
         self.waveform = waveform
+        self.mode = mode
     
-    def generate(self, frequency, duration, amplitude=1.0):
-        """Generates the base waveform."""
+    def generate(self, frequency, duration, amplitude=1.0, out=None):
+        """Generates the base waveform as SAMPLE_DTYPE samples (into out, if given).
+
+        frequency may also be a 1-D array, in which case one row per frequency is
+        rendered in a single pass and a (voices, samples) array is returned.
+        """
+        if self.mode == "wavetable" and WAVETABLES.has(self.waveform):
+            return WAVETABLES.render(self.waveform, frequency, int(SAMPLE_RATE * duration), amplitude=amplitude, out=out)
+
         t = np.linspace(0, duration, int(SAMPLE_RATE * duration), endpoint=False)
-        
+        if np.ndim(frequency) > 0:
+            frequency = np.asarray(frequency, dtype=float)[:, None]
+        return _store(self._naive(frequency, t, amplitude), out)
+
+    def generate_block(self, frequency, n_samples, phase=0.0, amplitude=1.0, out=None):
+        """Generates the next n_samples of a running oscillator.
+
+        phase is the position within the cycle (0..1) at the first sample, one per
+        frequency when frequency is an array. Returns (wave, next_phase) so that
+        consecutive blocks join without discontinuities.
+        """
+        next_phase = np.mod(phase + np.multiply(frequency, n_samples / SAMPLE_RATE), 1.0)
+        if self.mode == "wavetable" and WAVETABLES.has(self.waveform):
+            wave = WAVETABLES.render(self.waveform, frequency, n_samples, phase=phase, amplitude=amplitude, out=out)
+            return wave, next_phase
+
+        t = np.arange(n_samples) / SAMPLE_RATE
+        frequency = np.asarray(frequency, dtype=float)
+        # start time of the cycle position reached so far
+        offset = np.divide(phase, frequency, out=np.zeros(np.shape(frequency)), where=frequency != 0)
+        if frequency.ndim > 0:
+            frequency = frequency[:, None]
+            offset = offset[:, None]
+        return _store(self._naive(frequency, offset + t, amplitude), out), next_phase
+
+    def _naive(self, frequency, t, amplitude):
+        """Sums the (aliasing) waveform shapes directly at the times t."""
         if self.waveform == "Sine":
             return amplitude * np.sin(2 * np.pi * frequency * t)
         elif self.waveform == "Square":
@@ -59,4 +100,11 @@ class Oscillator:
                 harmonics += (1/n) * (2 * (t * n * frequency - np.floor(0.5 + t * n * frequency)))
             return amplitude * (base + harmonics) / 16.0
         else:
-            return np.zeros(len(t))
+            return np.zeros(np.broadcast(frequency, t).shape)
+
+def _store(wave, out):
+    """Returns wave as SAMPLE_DTYPE, copied into out when given."""
+    if out is None:
+        return np.asarray(wave, dtype=SAMPLE_DTYPE)
+    out[...] = wave
+    return out
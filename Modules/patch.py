@@ -0,0 +1,123 @@
+from dataclasses import dataclass
+import numpy as np
+
+from Modules.utils import SAMPLE_RATE, MAX_FREQ, SAMPLE_DTYPE, CONTROL_BLOCK, clamp
+from Modules.adsr import ADSR
+from Modules.filter import Filter
+from Modules.oscillator import Oscillator
+from Modules.cache import state_key
+from Modules.modulation import ModMatrix, control_positions, to_audio_rate
+
+UNISON_SPREAD = 30 # cents spread around the center detune
+MIN_CUTOFF = 20.0 # cutoff at the bottom of the filter envelope sweep
+
+def unison_ratios(detune, unison_count):
+    """Returns the frequency ratio of every unison voice for a detune in cents."""
+    # Voice 0 is at detune when there is a single voice,
+    # otherwise the voices spread evenly around the base detune
+    if unison_count <= 1:
+        cents = np.array([float(detune)])
+    else:
+        offsets = np.arange(unison_count) - (unison_count - 1) / 2.0
+        cents = detune + offsets * (UNISON_SPREAD / (unison_count - 1))
+    return 2 ** (cents / 1200.0)
+
+def _read_only(array):
+    array.setflags(write=False)
+    return array
+
+@dataclass(frozen=True, eq=False)
+class VoicePatch:
+    """One compiled oscillator + filter voice of a Patch."""
+    oscillator: Oscillator
+    ratios: np.ndarray # frequency ratio of every unison layer
+    filter: Filter
+    cutoff_control: np.ndarray # cutoff per CONTROL_BLOCK samples (filter envelope + modulation)
+    gain: float # weight in the voice 1 / voice 2 mix, folded into the unison average
+    n_samples: int
+    filter_adsr: ADSR # for held notes, whose filter envelope is evaluated as they play
+    cutoff_knob: float
+
+@dataclass(frozen=True, eq=False)
+class Patch:
+    """Everything a note needs that does not depend on its pitch, compiled once.
+
+    A note is rendered from a patch and a frequency alone. The arrays are
+    read-only and the filter/oscillator objects are shared by every note of
+    the patch, so a patch must not be modified once compiled.
+    """
+    voice1: VoicePatch
+    voice2: VoicePatch # None when voice 2 is off
+    amp_env: np.ndarray # amplitude envelope over the note
+    duration: float
+    n_samples: int
+    key: str # state_key of the settings, for caching renders
+    amp_adsr: ADSR # for held notes (see GatedNoteStream)
+    modulation: ModMatrix
+
+def compile_voice(osc_params, filter_params, filter_adsr_vars, duration, gain=1.0, cutoff_mod=None):
+    """Compiles the settings of one voice (see VoicePatch).
+
+    The filter envelope is evaluated at the control rate only; cutoff_mod is an
+    optional control-rate offset in octaves (from the mod matrix).
+    """
+    n_samples = int(SAMPLE_RATE * duration)
+    filter_obj = Filter(**filter_params)
+    filter_obj.prepare()
+    filter_adsr = ADSR(**filter_adsr_vars)
+    filter_env = filter_adsr.at(control_positions(n_samples), n_samples)
+    cutoff_knob = clamp(filter_obj.cutoff, MIN_CUTOFF, MAX_FREQ)
+    cutoff_control = MIN_CUTOFF + filter_env * (cutoff_knob - MIN_CUTOFF)
+    if cutoff_mod is not None:
+        cutoff_control = np.clip(cutoff_control * 2.0 ** cutoff_mod, MIN_CUTOFF, MAX_FREQ)
+    return VoicePatch(
+        oscillator=Oscillator(osc_params['waveform']),
+        ratios=_read_only(unison_ratios(osc_params['detune'], osc_params.get('unison', 1))),
+        filter=filter_obj,
+        cutoff_control=_read_only(cutoff_control),
+        gain=float(gain),
+        n_samples=n_samples,
+        filter_adsr=filter_adsr,
+        cutoff_knob=float(cutoff_knob)
+    )
+
+def compile_patch(state):
+    """Compiles a note state dict (the note, freq and duration keys of a press
+    plus the GUI settings) into a Patch; note and freq are ignored.
+
+    The optional 'modulation' entry describes LFOs, extra envelopes and routes
+    (see ModMatrix.from_settings); the matrix is evaluated here, once per patch.
+    """
+    duration = state['duration']
+    mix_level = state['mix_level'] if state['use_voice2'] else 0.0
+    n_samples = int(SAMPLE_RATE * duration)
+    matrix = ModMatrix.from_settings(state.get('modulation'))
+    modulation = matrix.evaluate(n_samples)
+
+    voice1 = state['voice1_params']
+    voice1 = compile_voice(voice1, voice1['filter_vars'], voice1['adsr_vars'], duration, 1.0 - mix_level,
+                           modulation.get('voice1.cutoff'))
+    voice2 = None
+    if state['use_voice2']:
+        voice2 = state['voice2_params']
+        voice2 = compile_voice(voice2, voice2['filter_vars'], voice2['adsr_vars'], duration, mix_level,
+                               modulation.get('voice2.cutoff'))
+
+    amp_adsr = ADSR(**state['amp_adsr_vars'])
+    amp_env = amp_adsr.get_envelope(duration, total_samples=n_samples)
+    if 'amp' in modulation:
+        # the only target interpolated to audio rate (the envelope multiplies every sample anyway)
+        tremolo = np.maximum(1.0 + to_audio_rate(modulation['amp'], n_samples, CONTROL_BLOCK), 0.0)
+        amp_env = _read_only((amp_env * tremolo).astype(SAMPLE_DTYPE))
+
+    settings = {name: value for name, value in state.items() if name not in ('note', 'freq')}
+    return Patch(
+        voice1=voice1,
+        voice2=voice2,
+        amp_env=amp_env,
+        duration=duration,
+        n_samples=n_samples,
+        key=state_key(settings),
+        amp_adsr=amp_adsr,
+        modulation=matrix
+    )
@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+import threading
+
+from Modules.utils import note_to_frequency
+from Modules.render import render_patch_note
+
+KEYBOARD_NOTES = range(48, 96) # the notes of the on-screen keyboard
+PRERENDER_DELAY = 0.5 # seconds without parameter changes before pre-rendering starts
+
+class PreRenderer:
+    """Renders every keyboard note of a patch into a RenderCache in the background.
+
+    schedule() (re)starts a debounce timer; once it expires without another
+    schedule() the notes are rendered one by one on a daemon thread, nearest to
+    middle C first, under the same (patch.key, note) keys the key presses use.
+    A newer schedule() or cancel() abandons the running job after its current
+    note. The job steps aside while any foreground() render is in progress.
+    """
+
+    def __init__(self, cache, notes=KEYBOARD_NOTES, delay=PRERENDER_DELAY):
+        self.cache = cache
+        self.notes = sorted(notes, key=lambda note: (abs(note - 60), note))
+        self.delay = delay
+        self.done = 0 # notes of the current patch in the cache so far
+        self.total = 0
+        self._generation = 0
+        self._timer = None
+        self._foreground = 0
+        self._cond = threading.Condition()
+
+    @property
+    def progress(self):
+        """Returns (done, total) for the latest scheduled patch."""
+        return self.done, self.total
+
+    def schedule(self, patch):
+        """Pre-renders the notes of patch once delay seconds pass without another call."""
+        with self._cond:
+            self._generation += 1
+            generation = self._generation
+            self.done, self.total = 0, len(self.notes)
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self._start, args=(patch, generation))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel(self):
+        """Stops any pending or running job."""
+        with self._cond:
+            self._generation += 1
+            self.done = self.total = 0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._cond.notify_all()
+
+    @contextmanager
+    def foreground(self):
+        """Context for an interactive render; background work waits until it is over."""
+        with self._cond:
+            self._foreground += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._foreground -= 1
+                self._cond.notify_all()
+
+    def _start(self, patch, generation):
+        threading.Thread(target=self._run, args=(patch, generation), daemon=True).start()
+
+    def _stale(self, generation):
+        return generation != self._generation
+
+    def _run(self, patch, generation):
+        for note in self.notes:
+            with self._cond:
+                self._cond.wait_for(lambda: self._foreground == 0 or self._stale(generation))
+                if self._stale(generation):
+                    return
+            key = (patch.key, note)
+            if key not in self.cache:
+                self.cache.put(key, render_patch_note(patch, note_to_frequency(note)))
+            with self._cond:
+                if self._stale(generation):
+                    return
+                self.done += 1
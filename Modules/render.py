@@ -0,0 +1,315 @@
+from functools import partial
+import sys
+import numpy as np
+
+from Modules.utils import note_to_frequency, normalize_wave, STREAM_BLOCK_SIZE, PARALLEL_MIN_SAMPLES, CONTROL_BLOCK, MAX_FREQ
+from Modules.buffers import ScratchBuffers, thread_scratch
+from Modules.executor import render_threads, run_parallel
+from Modules.adsr import ADSR, GatedADSR
+from Modules.patch import compile_voice, compile_patch, MIN_CUTOFF
+
+def _unison_mean(raw, n_notes, n_unison, gain, out):
+    """Averages the unison rows of a (notes * unison, samples) matrix into out
+    (notes, samples), scaled by the voice's mix gain."""
+    layers = raw.reshape(n_notes, n_unison, -1)
+    if n_unison == 1:
+        np.multiply(layers[:, 0], gain, out=out)
+        return out
+    np.sum(layers, axis=1, out=out)
+    out *= gain / n_unison
+    return out
+
+def _oscillate(oscillator, freqs, duration, out):
+    """Renders every row of out (one per frequency), split into groups of rows
+    across the render executor when the job is large enough."""
+    groups = min(render_threads(), freqs.shape[0], max(1, out.size // PARALLEL_MIN_SAMPLES))
+    if groups <= 1:
+        return oscillator.generate(freqs, duration, out=out)
+    bounds = np.linspace(0, freqs.shape[0], groups + 1).astype(int)
+    run_parallel([
+        partial(oscillator.generate, freqs[start:stop], duration, out=out[start:stop])
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ])
+    return out
+
+def _render_voice(voice, base_freqs, duration, out=None):
+    """Renders a compiled VoicePatch (oscillator + unison, filter sweep, mix gain)
+    for several notes at once, without the amplitude envelope.
+
+    All unison layers of all notes go through the oscillator as a single
+    (notes * unison, samples) matrix, are averaged per note, and the (notes,
+    samples) result is filtered in one pass. Large oscillator jobs are split by
+    rows across the render executor. The intermediate stages reuse the calling
+    thread's scratch buffers; the result goes to out or a new array.
+    """
+    n_notes, n_unison = base_freqs.shape[0], voice.ratios.shape[0]
+    n_samples = voice.n_samples
+    scratch = thread_scratch()
+
+    # 1. All unison layers of all notes in one oscillator pass
+    freqs = (base_freqs[:, None] * voice.ratios[None, :]).ravel()
+    raw = scratch.get('raw', (freqs.shape[0], n_samples))
+    _oscillate(voice.oscillator, freqs, duration, raw)
+    mixed = _unison_mean(raw, n_notes, n_unison, voice.gain, scratch.get('mixed', (n_notes, n_samples)))
+
+    # 2. Filter with the filter envelope sweeping the cutoff
+    if out is None:
+        out = np.empty_like(mixed)
+    return voice.filter.apply(mixed, cutoff_envelope=voice.cutoff_control, control_block=CONTROL_BLOCK, out=out)
+
+def render_voice(osc_params, filter_params, filter_adsr_vars, amp_adsr_vars, base_freqs, duration):
+    """Renders one voice (oscillator + unison, filter envelope, filter, amp envelope)
+    for several notes at once and returns a (notes, samples) array."""
+    base_freqs = np.atleast_1d(np.asarray(base_freqs, dtype=float))
+    voice = compile_voice(osc_params, filter_params, filter_adsr_vars, duration)
+    wave = _render_voice(voice, base_freqs, duration)
+    return ADSR(**amp_adsr_vars).apply_envelope(wave, duration, out=wave)
+
+def render_patch(patch, base_freqs):
+    """Renders a compiled Patch for several frequencies.
+
+    Returns a (notes, samples) array of un-normalized voice 1 / voice 2 mixes.
+    Voice 1 and voice 2 are rendered concurrently on the render executor and
+    joined before mixing; the result does not depend on the thread count.
+    """
+    base_freqs = np.atleast_1d(np.asarray(base_freqs, dtype=float))
+    if patch.voice2 is None:
+        wave = _render_voice(patch.voice1, base_freqs, patch.duration)
+    else:
+        wave2 = thread_scratch().get('voice2', (base_freqs.shape[0], patch.n_samples))
+        wave, wave2 = run_parallel([
+            partial(_render_voice, patch.voice1, base_freqs, patch.duration),
+            partial(_render_voice, patch.voice2, base_freqs, patch.duration, out=wave2)
+        ])
+        wave += wave2
+
+    # amplitude ADSR, once for the mix (in place, wave is a fresh buffer)
+    wave *= patch.amp_env
+    return wave
+
+def render_patch_note(patch, freq):
+    """Renders one note of a compiled Patch and returns the un-normalized wave
+    (the engine's limiter controls the level of the mixed bus)."""
+    return render_patch(patch, [freq])[0]
+
+def render_notes(state, base_freqs):
+    """Renders the patch described by a note state for several frequencies.
+
+    Returns a (notes, samples) array of un-normalized voice 1 / voice 2 mixes.
+    """
+    return render_patch(compile_patch(state), base_freqs)
+
+def render_note(state):
+    """Renders the note described by a state dict and returns the un-normalized wave."""
+    return render_patch_note(compile_patch(state), state['freq'])
+
+def render_chord(state, notes):
+    """Renders several MIDI notes with the patch of state and returns their normalized sum."""
+    freqs = [note_to_frequency(note) for note in notes]
+    wave = render_notes(state, freqs).sum(axis=0)
+    return normalize_wave(wave, out=wave)
+
+class VoiceStream:
+    """Renders one compiled voice for several notes block by block.
+
+    The oscillator phase, the position in the filter sweep and the filter state
+    are carried from one block to the next, so the concatenated blocks match
+    the one-shot render (exactly, for blocks that are multiples of
+    FILTER_BLOCK_SIZE). reset() restarts the stream on another note, so a
+    stream can be kept and reused; created without a voice the stream is idle
+    (already finished) until its first reset. Each stream has its own scratch
+    buffers for the intermediate stages.
+    """
+
+    def __init__(self, voice=None, base_freqs=None):
+        self.scratch = ScratchBuffers()
+        self.voice = None
+        self.total_samples = 0
+        self.position = 0
+        if voice is not None:
+            self.reset(voice, base_freqs)
+
+    def reset(self, voice, base_freqs, total_samples=None):
+        """Restarts the stream at the beginning of new notes of a VoicePatch
+        (lasting total_samples, the voice's length by default)."""
+        base_freqs = np.atleast_1d(np.asarray(base_freqs, dtype=float))
+        self.voice = voice
+        self.shape = (base_freqs.shape[0], voice.ratios.shape[0])
+        self.freqs = (base_freqs[:, None] * voice.ratios[None, :]).ravel()
+        self.phase = np.zeros(self.freqs.shape[0])
+        self.total_samples = voice.n_samples if total_samples is None else total_samples
+        self.position = 0
+        self.zi = None
+
+    @property
+    def finished(self):
+        return self.position >= self.total_samples
+
+    def next_block(self, frames, out=None, control=None):
+        """Renders the next (up to) frames samples as a (notes, samples) array.
+
+        The block is written into out (notes, samples) when given, else into a
+        new array. control optionally replaces the voice's cutoff curve with
+        (control-rate cutoffs, position of this block's first sample relative
+        to the first of them).
+        """
+        start = self.position
+        stop = min(start + frames, self.total_samples)
+        n_notes, n_unison = self.shape
+        voice = self.voice
+
+        # 1. Oscillator (all unison layers of all notes), continuing the phase
+        raw = self.scratch.get('raw', (n_notes * n_unison, stop - start))
+        raw, self.phase = voice.oscillator.generate_block(self.freqs, stop - start, self.phase, out=raw)
+        mixed = _unison_mean(raw, n_notes, n_unison, voice.gain, self.scratch.get('mixed', (n_notes, stop - start)))
+
+        # 2. Filter, continuing from the state at the end of the previous block
+        cutoff, offset = (voice.cutoff_control, start) if control is None else control
+        if self.zi is None:
+            self.zi = voice.filter.initial_state(mixed, cutoff_envelope=cutoff)
+        if out is None:
+            out = np.empty_like(mixed)
+        filtered, self.zi = voice.filter.apply(mixed, cutoff_envelope=cutoff, zi=self.zi, out=out,
+                                               control_block=CONTROL_BLOCK, offset=offset)
+        self.position = stop
+        return filtered
+
+class NoteStream:
+    """Renders a compiled Patch (voice 1, optional voice 2, amp envelope) block by block.
+
+    Like VoiceStream it can be created idle and reset() for every new note, which
+    is how the voice pool reuses its render objects.
+    """
+
+    def __init__(self, patch=None, base_freqs=None):
+        self.stream1 = VoiceStream()
+        self.stream2 = VoiceStream()
+        self.patch = None
+        self.position = 0
+        self.total_samples = 0
+        if patch is not None:
+            self.reset(patch, base_freqs)
+
+    def reset(self, patch, base_freqs):
+        """Restarts at the beginning of new notes of a patch."""
+        self.patch = patch
+        self.stream1.reset(patch.voice1, base_freqs)
+        if patch.voice2 is not None:
+            self.stream2.reset(patch.voice2, base_freqs)
+        self.position = 0
+        self.total_samples = patch.n_samples
+
+    @property
+    def finished(self):
+        return self.position >= self.total_samples
+
+    @property
+    def remaining(self):
+        """Samples left to render."""
+        return self.total_samples - self.position
+
+    def next_block(self, frames, out=None):
+        """Renders the next (up to) frames samples as a (notes, samples) array (into out, if given)."""
+        start = self.position
+        block = self.stream1.next_block(frames, out=out)
+        if self.patch.voice2 is not None:
+            block += self.stream2.next_block(frames, out=self.stream2.scratch.get('block', block.shape))
+        block *= self.patch.amp_env[start:start + block.shape[-1]]
+        self.position = start + block.shape[-1]
+        return block
+
+class GatedNoteStream:
+    """Renders a compiled Patch for as long as its key is held.
+
+    Unlike NoteStream the note has no fixed length: the amp and filter
+    envelopes sustain until release() (the note-off) and the note finishes at
+    the end of the amp release. The envelopes and the mod matrix are
+    evaluated per block at the control rate (the amp envelope at audio rate,
+    being a cheap piecewise line); LFOs run on for the whole note.
+    """
+
+    def __init__(self):
+        self.stream1 = VoiceStream()
+        self.stream2 = VoiceStream()
+        self.amp = GatedADSR()
+        self.filter1 = GatedADSR()
+        self.filter2 = GatedADSR()
+        self.patch = None
+        self.position = 0
+
+    def reset(self, patch, base_freqs):
+        """Starts new held notes of a patch."""
+        self.patch = patch
+        self.position = 0
+        self.amp.reset(patch.amp_adsr)
+        self.stream1.reset(patch.voice1, base_freqs, total_samples=sys.maxsize)
+        self.filter1.reset(patch.voice1.filter_adsr)
+        if patch.voice2 is not None:
+            self.stream2.reset(patch.voice2, base_freqs, total_samples=sys.maxsize)
+            self.filter2.reset(patch.voice2.filter_adsr)
+
+    def release(self):
+        """Starts the release segments at the current position (the note-off)."""
+        for envelope in (self.amp, self.filter1, self.filter2):
+            envelope.release(self.position)
+
+    @property
+    def finished(self):
+        end = self.amp.end
+        return self.patch is None or (end is not None and self.position >= end)
+
+    @property
+    def remaining(self):
+        """Samples left to render (sys.maxsize while the note is held)."""
+        if self.patch is None:
+            return 0
+        end = self.amp.end
+        return sys.maxsize if end is None else max(0, end - self.position)
+
+    def _cutoff(self, voice, envelope, positions, modulation, target):
+        cutoff = MIN_CUTOFF + envelope.values(positions) * (voice.cutoff_knob - MIN_CUTOFF)
+        if target in modulation:
+            cutoff = np.clip(cutoff * 2.0 ** modulation[target], MIN_CUTOFF, MAX_FREQ)
+        return cutoff
+
+    def next_block(self, frames, out=None):
+        """Renders the next frames samples as a (notes, samples) array (into out, if given)."""
+        start = self.position
+        stop = start + frames
+        patch = self.patch
+
+        # control steps around the block, evaluated once for every target
+        first = max(start // CONTROL_BLOCK - 1, 0)
+        steps = np.arange(first, stop // CONTROL_BLOCK + 2) * CONTROL_BLOCK + CONTROL_BLOCK // 2
+        modulation = patch.modulation.evaluate_at(steps, patch.n_samples)
+        offset = start - steps[0] + CONTROL_BLOCK // 2
+
+        cutoff = self._cutoff(patch.voice1, self.filter1, steps, modulation, 'voice1.cutoff')
+        block = self.stream1.next_block(frames, out=out, control=(cutoff, offset))
+        if patch.voice2 is not None:
+            cutoff = self._cutoff(patch.voice2, self.filter2, steps, modulation, 'voice2.cutoff')
+            block += self.stream2.next_block(frames, out=self.stream2.scratch.get('block', block.shape),
+                                             control=(cutoff, offset))
+
+        positions = np.arange(start, stop)
+        envelope = self.amp.values(positions)
+        if 'amp' in modulation:
+            envelope *= np.maximum(1.0 + np.interp(positions, steps, modulation['amp']), 0.0)
+        block *= envelope.astype(block.dtype)
+        self.position = stop
+        return block
+
+def stream_notes(state, base_freqs, block_size=STREAM_BLOCK_SIZE):
+    """Yields the notes of a state as consecutive (notes, block_size) blocks.
+
+    Playback can start as soon as the first block exists, whatever the note length.
+    The blocks are not normalized, like render_patch_note.
+    """
+    stream = NoteStream(compile_patch(state), base_freqs)
+    while not stream.finished:
+        yield stream.next_block(block_size)
+
+def stream_note(state, block_size=STREAM_BLOCK_SIZE):
+    """Yields the note of a state as consecutive 1-D blocks, ready for AudioEngine.play_blocks."""
+    for block in stream_notes(state, [state['freq']], block_size):
+        yield block[0]
@@ -0,0 +1,101 @@
+from collections import deque
+from dataclasses import dataclass
+import heapq
+import itertools
+import time
+
+from Modules.metrics import METRICS
+
+EVENT_KINDS = ("note_on", "note_off", "param")
+
+@dataclass(frozen=True)
+class Event:
+    """A timestamped event on the engine's sample clock.
+
+    note_on/note_off use note and velocity (0..1); a note_on may carry the
+    Patch to play in value (else the engine's current patch) and a NoteTimeline
+    to trace in timeline. param events set name to value.
+    """
+    frame: int # sample position on the engine clock (0 = first sample of the stream)
+    kind: str
+    note: int = None
+    velocity: float = 1.0
+    name: str = None
+    value: object = None
+    timeline: object = None
+
+
+class EventScheduler:
+    """Queues timestamped events and hands them to the audio callback at the
+    sample offset they are due inside its block.
+
+    post() may be called from any thread; only the audio thread pops events
+    (the incoming deque's append/popleft are atomic, the heap is private to
+    it). Events stamped from wall-clock time (stamp()) are placed latency
+    samples after the arrival time, mapped through the clock the callback
+    records, so their timing is exact to the sample relative to each other
+    however late the posting thread ran. Events due before the current block
+    (late) are applied at its start and counted. clock is the time source of
+    stamps (the output backend's, so simulated streams stamp in simulated time).
+    """
+
+    def __init__(self, samplerate, latency, clock=time.perf_counter):
+        self.samplerate = samplerate
+        self.latency = latency # samples between an event's arrival and its playback
+        self.clock = clock
+        self._incoming = deque()
+        self._queue = [] # (frame, sequence, event), audio thread only
+        self._sequence = itertools.count()
+        self._clock = (clock(), 0) # (clock time, frame) at the start of the last block
+        self.late_events = 0
+
+    def stamp(self, when=None):
+        """Returns the frame at which something arriving at clock time when
+        (now by default) should sound."""
+        when = self.clock() if when is None else when
+        started, frame = self._clock
+        return frame + int(round((when - started) * self.samplerate)) + self.latency
+
+    def post(self, event):
+        self._incoming.append(event)
+
+    def note_on(self, note, velocity=1.0, patch=None, frame=None, timeline=None):
+        self.post(Event(self.stamp() if frame is None else frame, "note_on", note, velocity, value=patch,
+                        timeline=timeline))
+
+    def note_off(self, note, frame=None):
+        self.post(Event(self.stamp() if frame is None else frame, "note_off", note, 0.0))
+
+    def param(self, name, value, frame=None):
+        self.post(Event(self.stamp() if frame is None else frame, "param", name=name, value=value))
+
+    def schedule(self, events, start=None):
+        """Posts events whose frame is relative to start (by default latency
+        samples from now), e.g. a sequence read from a MIDI file."""
+        start = self.stamp() if start is None else start
+        for event in events:
+            self.post(Event(start + event.frame, event.kind, event.note, event.velocity, event.name, event.value,
+                            event.timeline))
+
+    def clear(self):
+        self._incoming.clear()
+        self._queue.clear()
+
+    @property
+    def pending(self):
+        return len(self._incoming) + len(self._queue)
+
+    def due(self, start, frames, now=None):
+        """Audio thread: yields (offset, event) for every event due in the block of
+        frames samples starting at frame start, in time order."""
+        self._clock = (self.clock() if now is None else now, start)
+        while self._incoming:
+            event = self._incoming.popleft()
+            heapq.heappush(self._queue, (event.frame, next(self._sequence), event))
+        end = start + frames
+        while self._queue and self._queue[0][0] < end:
+            frame, _, event = heapq.heappop(self._queue)
+            if frame < start:
+                self.late_events += 1
+                METRICS.counter("scheduler.late_events").inc()
+            yield max(frame - start, 0), event
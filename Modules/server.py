@@ -0,0 +1,290 @@
+"""Local render server: renders notes for other processes over a Unix or TCP socket.
+
+Usage:
+    python -m Modules.server [--unix PATH | --host 127.0.0.1 --port 8765]
+                             [--workers N] [--max-pending N]
+
+Protocol (one connection carries any number of requests; a client may send
+requests without waiting for the answers, and answers come back in request
+order):
+
+    request:  one JSON line
+              {"id": any, "op": "render", "patch": {...}, "notes": [...], "format": "f32"}
+              patch holds overrides of offline.DEFAULT_PATCH; every note is
+              {"pitch", "duration", "velocity"} (only pitch is required).
+              A request line may hold up to SERVER_MAX_REQUEST_BYTES, with up to
+              SERVER_MAX_NOTES notes of at most SERVER_MAX_DURATION seconds and
+              SERVER_MAX_FRAMES frames in all (the sum of the note durations).
+              {"op": "ping"} and {"op": "stats"} are answered with a header only.
+    response: one JSON header line
+              {"id", "status": "ok", "frames": [frames per note], "bytes": N,
+               "samplerate", "format"}
+              followed by N bytes of PCM, the notes one after another
+              ("f32": float32, "s16": int16, little endian, mono);
+              on failure {"id", "status": "error", "error": message} and no data.
+
+Compiled patches are kept in an LRU keyed by their settings, and the notes of
+one request that share a duration are rendered together in one pass, so a
+request costs little more than its oscillator and filter work.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import argparse
+import asyncio
+import json
+import os
+import socket
+import numpy as np
+
+from Modules.utils import note_to_frequency, SAMPLE_RATE
+from Modules.patch import compile_patch
+from Modules.render import render_patch
+from Modules.offline import make_patch, note_state
+from Modules.executor import set_render_threads
+from Modules.wavetable import WAVETABLES
+from Modules.kernels import prepare as prepare_kernels
+from Modules.metrics import METRICS
+
+SERVER_PORT = 8765 # Default TCP port (bound to localhost only)
+SERVER_WORKERS = 4 # Render threads behind the server
+SERVER_MAX_PENDING = 64 # Requests rendering or queued at once, over all connections
+SERVER_PATCH_CACHE = 256 # Compiled patches kept for reuse
+SERVER_MAX_REQUEST_BYTES = 16 * 1024 * 1024 # Longest request line accepted
+SERVER_MAX_NOTES = 10000 # Notes per request
+SERVER_MAX_DURATION = 60.0 # Seconds per note
+SERVER_MAX_FRAMES = 600 * SAMPLE_RATE # Frames per request, over all its notes (about 100 MB of float32)
+PCM_FORMATS = {'f32': '<f4', 's16': '<i2'}
+
+@lru_cache(maxsize=SERVER_PATCH_CACHE)
+def _compiled(patch_json, duration):
+    return compile_patch(note_state(make_patch(json.loads(patch_json)), 60, duration))
+
+def render_request(request):
+    """Renders the notes of a render request. Returns (frames per note, PCM bytes)."""
+    patch_json = json.dumps(request.get('patch') or {}, sort_keys=True)
+    notes = request.get('notes', [])
+    pcm_format = request.get('format', 'f32')
+    if pcm_format not in PCM_FORMATS:
+        raise ValueError(f"unknown format {pcm_format!r}")
+    if len(notes) > SERVER_MAX_NOTES:
+        raise ValueError(f"too many notes ({len(notes)} > {SERVER_MAX_NOTES})")
+
+    # notes of equal duration share a patch and are rendered as one matrix
+    groups = {}
+    frames = 0
+    for index, note in enumerate(notes):
+        if not isinstance(note, dict):
+            raise ValueError("every note must be an object")
+        duration = float(note.get('duration', 0.5))
+        if not 0.0 < duration <= SERVER_MAX_DURATION:
+            raise ValueError(f"note duration must be in (0, {SERVER_MAX_DURATION}] seconds")
+        frames += int(duration * SAMPLE_RATE)
+        if frames > SERVER_MAX_FRAMES:
+            raise ValueError(f"notes too long (more than {SERVER_MAX_FRAMES} frames in all)")
+        groups.setdefault(duration, []).append(index)
+    waves = [None] * len(notes)
+    for duration, indexes in groups.items():
+        patch = _compiled(patch_json, duration)
+        rendered = render_patch(patch, [note_to_frequency(notes[i]['pitch']) for i in indexes])
+        for row, i in zip(rendered, indexes):
+            velocity = notes[i].get('velocity', 1.0)
+            waves[i] = row * velocity if velocity != 1.0 else row
+
+    pcm = np.concatenate(waves) if waves else np.zeros(0)
+    if pcm_format == 's16':
+        pcm = np.clip(pcm * 32767.0, -32768, 32767)
+    return [len(wave) for wave in waves], pcm.astype(PCM_FORMATS[pcm_format]).tobytes()
+
+
+class RenderServer:
+    """asyncio server handing render requests to a bounded thread pool.
+
+    Each connection reads requests as fast as they arrive and starts their
+    renders at once (up to max_pending in flight over all connections, after
+    which reading waits), while a writer task sends the answers in request
+    order as each one completes.
+    """
+
+    def __init__(self, workers=SERVER_WORKERS, max_pending=SERVER_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.requests = 0
+        self.errors = 0
+        self.connections = 0
+        self._executor = None
+        self._slots = None
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=SERVER_PORT, unix_path=None):
+        # the pool threads already use the cores, so each render runs serially
+        set_render_threads(1)
+        WAVETABLES.build_all()
+        prepare_kernels()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="render-server")
+        self._slots = asyncio.Semaphore(self.max_pending)
+        if unix_path:
+            if os.path.exists(unix_path):
+                os.unlink(unix_path)
+            self._server = await asyncio.start_unix_server(self._handle, path=unix_path,
+                                                           limit=SERVER_MAX_REQUEST_BYTES)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port, limit=SERVER_MAX_REQUEST_BYTES)
+        return self._server
+
+    async def serve_forever(self, **address):
+        server = await self.start(**address)
+        async with server:
+            await server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self):
+        return {'requests': self.requests, 'errors': self.errors, 'connections': self.connections,
+                'patch_cache': _compiled.cache_info()._asdict()}
+
+    async def _run(self, request):
+        """Returns the (header, data) answer of one request, releasing its slot when done."""
+        try:
+            op = request.get('op', 'render')
+            if 'parse_error' in request:
+                raise ValueError(request['parse_error'])
+            if op == 'ping':
+                return {'id': request.get('id'), 'status': 'ok'}, b''
+            if op == 'stats':
+                return dict(self.stats(), id=request.get('id'), status='ok'), b''
+            if op != 'render':
+                raise ValueError(f"unknown op {op!r}")
+            loop = asyncio.get_running_loop()
+            frames, data = await loop.run_in_executor(self._executor, render_request, request)
+            header = {'id': request.get('id'), 'status': 'ok', 'frames': frames, 'bytes': len(data),
+                      'samplerate': SAMPLE_RATE, 'format': request.get('format', 'f32')}
+            return header, data
+        except Exception as error:
+            self.errors += 1
+            METRICS.counter("server.errors").inc()
+            return {'id': request.get('id'), 'status': 'error', 'error': str(error)}, b''
+        finally:
+            self._slots.release()
+
+    async def _write_answers(self, answers, writer):
+        while True:
+            answer = await answers.get()
+            if answer is None:
+                return
+            request_id, task = answer
+            try:
+                header, data = await task
+            except Exception as error:
+                # a failed answer still gets its header, so the requests after it are answered
+                self.errors += 1
+                METRICS.counter("server.errors").inc()
+                header, data = {'id': request_id, 'status': 'error', 'error': str(error)}, b''
+            writer.write(json.dumps(header).encode() + b'\n')
+            if data:
+                writer.write(data)
+            await writer.drain()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        answers = asyncio.Queue()
+        sender = asyncio.create_task(self._write_answers(answers, writer))
+        try:
+            closing = False
+            while not closing:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    # answer an oversized request, then close: the rest of its line
+                    # cannot be told apart from the next request
+                    request = {'op': 'invalid', 'parse_error': f"request longer than {SERVER_MAX_REQUEST_BYTES} bytes"}
+                    closing = True
+                else:
+                    if not line:
+                        break
+                    if not line.strip():
+                        continue
+                    try:
+                        request = json.loads(line)
+                    except ValueError as error:
+                        request = {'op': 'invalid', 'parse_error': f"bad request: {error}"}
+                    else:
+                        if not isinstance(request, dict):
+                            request = {'op': 'invalid', 'parse_error': "bad request: not a JSON object"}
+                self.requests += 1
+                await self._slots.acquire()
+                await answers.put((request.get('id'), asyncio.ensure_future(self._run(request))))
+        except ConnectionError:
+            pass
+        finally:
+            await answers.put(None)
+            try:
+                await sender
+            except ConnectionError:
+                pass
+            writer.close()
+
+
+class RenderClient:
+    """Blocking client for the render server (for sequencers and test harnesses).
+
+    send() only writes a request, so several can be pipelined before their
+    answers are read back, in order, with receive().
+    """
+
+    def __init__(self, host="127.0.0.1", port=SERVER_PORT, unix_path=None):
+        if unix_path:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(unix_path)
+        else:
+            self.sock = socket.create_connection((host, port))
+        self.file = self.sock.makefile('rwb')
+
+    def send(self, patch=None, notes=(), pcm_format='f32', request_id=None):
+        request = {'id': request_id, 'op': 'render', 'patch': patch or {}, 'notes': list(notes), 'format': pcm_format}
+        self.file.write(json.dumps(request).encode() + b'\n')
+        self.file.flush()
+
+    def receive(self):
+        """Reads the next answer. Returns (header, [one array per note])."""
+        header = json.loads(self.file.readline())
+        if header.get('status') != 'ok':
+            raise RuntimeError(header.get('error', 'render failed'))
+        data = self.file.read(header.get('bytes', 0))
+        pcm = np.frombuffer(data, dtype=PCM_FORMATS[header.get('format', 'f32')])
+        bounds = np.cumsum([0] + header.get('frames', []))
+        return header, [pcm[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def render(self, patch=None, notes=(), pcm_format='f32'):
+        self.send(patch, notes, pcm_format)
+        return self.receive()[1]
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve note renders over a local socket.")
+    parser.add_argument('--unix', help="listen on this Unix socket path instead of TCP")
+    parser.add_argument('--host', default="127.0.0.1", help="TCP address to bind")
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help="TCP port")
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS, help="render threads")
+    parser.add_argument('--max-pending', type=int, default=SERVER_MAX_PENDING, help="requests in flight at once")
+    args = parser.parse_args(argv)
+
+    server = RenderServer(args.workers, args.max_pending)
+    address = {'unix_path': args.unix} if args.unix else {'host': args.host, 'port': args.port}
+    try:
+        asyncio.run(server.serve_forever(**address))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+from contextlib import contextmanager
+from hashlib import sha1
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+from Modules.utils import SAMPLE_RATE, SAMPLE_DTYPE
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+SOUND_BANK_DIR = os.path.join(os.path.expanduser("~"), ".cache", "synth", "bank")
+SOUND_BANK_MB = 512 # Disk space the bank may use before least-recently-used entries go
+BANK_VERSION = 3 # Bump when a render change makes stored sounds stale
+INDEX_FILE = "index.json"
+LOCK_FILE = "index.lock"
+ORPHAN_GRACE_S = 3600 # Unindexed or temporary files older than this are left over from a crash
+
+@contextmanager
+def _file_lock(path):
+    """Holds an exclusive lock on the file at path, between processes."""
+    with open(path, 'a+') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class SoundBank:
+    """Persistent store of rendered notes and oscillator tables.
+
+    Every entry is a plain .npy file in one directory; index.json maps entry
+    names (built from the key, the sample rate, SAMPLE_DTYPE and BANK_VERSION)
+    to their file, size and last use. Entries are loaded with np.load(...,
+    mmap_mode='r'), so pages come in lazily and are shared between processes.
+    put() returns immediately; a writer thread saves the array to a temporary
+    file and renames it into place (as it does with the index), then evicts
+    least-recently-used entries beyond max_mb.
+
+    Several processes may share the directory: the index is re-read and
+    merged under a file lock whenever it is saved (temporary files are named
+    per process), and at startup .npy files no index lists (a process died
+    before indexing them) count towards max_mb too.
+    """
+
+    def __init__(self, path=SOUND_BANK_DIR, max_mb=SOUND_BANK_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = {}
+        self._queue = queue.Queue()
+        self._pending = 0 # arrays queued and not yet written (under _lock)
+        self._writer = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._lock:
+            self._sweep()
+
+    def _name(self, key):
+        parts = key if isinstance(key, tuple) else (key,)
+        prefix = f"v{BANK_VERSION}/{SAMPLE_RATE}/{np.dtype(SAMPLE_DTYPE).name}"
+        return "/".join([prefix] + [str(part) for part in parts])
+
+    def _file(self, name):
+        return os.path.join(self.path, sha1(name.encode('utf-8')).hexdigest() + ".npy")
+
+    def _temp(self, path):
+        return f"{path}.{os.getpid()}.tmp"
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.path, INDEX_FILE)) as f:
+                entries = json.load(f).get('entries', {})
+        except (OSError, ValueError):
+            return {}
+        # drop entries whose file has gone missing (evicted by another process)
+        return {name: entry for name, entry in entries.items() if os.path.exists(self._file(name))}
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._name(key) in self._index
+
+    def get(self, key):
+        """Returns the stored array for key as a read-only memmap, or None."""
+        name = self._name(key)
+        with self._lock:
+            entry = self._index.get(name)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry['used'] = time.time()
+        try:
+            array = np.load(self._file(name), mmap_mode='r')
+        except (OSError, ValueError):
+            with self._lock:
+                self._index.pop(name, None)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return array
+
+    def put(self, key, array):
+        """Queues array to be stored under key (the array must not change afterwards)."""
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, daemon=True)
+                self._writer.start()
+            self._pending += 1
+        self._queue.put((self._name(key), array))
+
+    def flush(self):
+        """Waits until every queued array is on disk and saves the index."""
+        self._queue.join()
+        with self._lock:
+            self._save_index()
+
+    def clear(self):
+        """Removes every entry from the bank."""
+        self._queue.join()
+        with self._lock, _file_lock(os.path.join(self.path, LOCK_FILE)):
+            self._merge_index()
+            for name in list(self._index):
+                self._remove(name)
+            self._write_index()
+
+    def stats(self):
+        with self._lock:
+            size = sum(entry['bytes'] for entry in self._index.values())
+            return {
+                'entries': len(self._index), 'size_mb': size / (1024 * 1024),
+                'max_mb': self.max_bytes / (1024 * 1024),
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions
+            }
+
+    def _write_loop(self):
+        while True:
+            name, array = self._queue.get()
+            try:
+                self._write(name, array)
+            except OSError:
+                pass # a full or read-only disk only costs the persistence
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                self._queue.task_done()
+
+    def _write(self, name, array):
+        path = self._file(name)
+        temp = self._temp(path)
+        with open(temp, 'wb') as f:
+            np.save(f, np.asarray(array))
+        os.replace(temp, path)
+        with self._lock:
+            self._index[name] = {'bytes': os.path.getsize(path), 'used': time.time()}
+            self._evict()
+            # save once the queue drains (this write is still counted)
+            if self._pending <= 1:
+                self._save_index()
+
+    def _evict(self, orphans=None):
+        """Removes least-recently-used entries, and unindexed files (orphans:
+        {path: (bytes, mtime)}), until the bank fits in max_bytes."""
+        orphans = orphans or {}
+        size = sum(entry['bytes'] for entry in self._index.values()) + sum(size for size, _ in orphans.values())
+        candidates = [(entry['used'], name, None) for name, entry in self._index.items()]
+        candidates += [(used, None, path) for path, (_, used) in orphans.items()]
+        for _, name, path in sorted(candidates, key=lambda candidate: candidate[0]):
+            if size <= self.max_bytes:
+                break
+            if name is not None:
+                size -= self._index[name]['bytes']
+                self._remove(name)
+            else:
+                size -= orphans[path][0]
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.evictions += 1
+
+    def _remove(self, name):
+        self._index.pop(name, None)
+        try:
+            os.remove(self._file(name))
+        except OSError:
+            pass
+
+    def _merge_index(self):
+        """Adds the entries other processes saved to the index (keeping the later use of shared ones)."""
+        for name, entry in self._read_index().items():
+            mine = self._index.get(name)
+            if mine is None:
+                self._index[name] = entry
+            else:
+                mine['used'] = max(mine['used'], entry['used'])
+
+    def _write_index(self):
+        path = os.path.join(self.path, INDEX_FILE)
+        temp = self._temp(path)
+        with open(temp, 'w') as f:
+            json.dump({'version': BANK_VERSION, 'entries': self._index}, f)
+        os.replace(temp, path)
+
+    def _save_index(self):
+        with _file_lock(os.path.join(self.path, LOCK_FILE)):
+            self._merge_index()
+            self._evict()
+            self._write_index()
+
+    def _sweep(self):
+        """Startup: loads the index and evicts beyond max_bytes counting unindexed
+        .npy files as well; those and temporary files older than ORPHAN_GRACE_S
+        are removed outright (younger ones may still be another process's writes)."""
+        try:
+            with _file_lock(os.path.join(self.path, LOCK_FILE)):
+                self._merge_index()
+                indexed = {self._file(name) for name in self._index}
+                orphans = {}
+                now = time.time()
+                for entry in os.scandir(self.path):
+                    if entry.path in indexed or not entry.name.endswith(('.npy', '.tmp')):
+                        continue
+                    stat = entry.stat()
+                    if now - stat.st_mtime > ORPHAN_GRACE_S:
+                        os.remove(entry.path)
+                    elif entry.name.endswith('.npy'):
+                        orphans[entry.path] = (stat.st_size, stat.st_mtime)
+                self._evict(orphans)
+                self._write_index()
+        except OSError:
+            self._merge_index() # a read-only bank still serves what it has
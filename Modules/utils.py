@@ -1,8 +1,21 @@
-from Modules.Libs.libs import *
+import logging
+import numpy as np
 
 # Global Constants
 SAMPLE_RATE = 44100
 MAX_FREQ = SAMPLE_RATE / 2 - 1 # Nyquist frequency limit
+FILTER_BLOCK_SIZE = 8 # Coefficient update interval of the time-varying filter
+FILTER_CHUNK = 128 # Samples solved in closed form between carried filter states
+FILTER_DESIGN_CACHE_SIZE = 512 # Static filter designs kept for reuse
+CUTOFF_STEP_CENTS = 1 # Static filter cutoffs are quantized to this pitch step
+CONTROL_BLOCK = 32 # Samples per step of the control-rate modulators (envelopes, LFOs)
+STREAM_BLOCK_SIZE = 512 # Frames per block of the audio stream and streamed notes
+MAX_POLYPHONY = 16 # Voices the audio engine can sound at once before stealing
+SAMPLE_DTYPE = np.float32 # Sample type of rendered audio (the device plays float32)
+RENDER_THREADS = None # Threads of the shared render executor (None: one per core, 1: serial)
+PARALLEL_MIN_SAMPLES = 65536 # Smallest oscillator job (voices * samples) that is split across threads
+KERNEL_BACKEND = "auto" # Backend of the inner-loop kernels ("auto": numba when installed, else "numpy")
+AUDIO_BACKEND = "sounddevice" # Output backend ("simulated": headless, see Modules.backends)
 
 def note_to_frequency(note):
     """Converts a MIDI note number to its corresponding frequency in Hz."""
@@ -10,21 +23,37 @@ def note_to_frequency(note):
     A4 = 440.0
     return A4 * 2**((note - 69) / 12.0)
 
-def normalize_wave(wave):
-    """Normalizes the wave amplitude to prevent clipping."""
-    max_amp = np.max(np.abs(wave))
-    return wave / max_amp if max_amp > 0 else wave
+def normalize_wave(wave, out=None):
+    """Normalizes the wave amplitude to prevent clipping.
+
+    Pass out (which may be wave itself) to write the result in place.
+    """
+    max_amp = max(np.max(wave, initial=0.0), -np.min(wave, initial=0.0))
+    if max_amp <= 0:
+        if out is None or out is wave:
+            return wave
+        out[...] = wave
+        return out
+    return np.multiply(wave, 1.0 / max_amp, out=out)
 
 def clamp(value, min_value, max_value):
     """Clamps a value within a specified range."""
     return max(min_value, min(value, max_value))
 
-def play_wave_dynamic(wave, duration):
-    """Plays a wave using a sounddevice stream."""
+def play_wave_dynamic(wave, duration, backend=None):
+    """Plays a wave on an output stream of backend (by default AUDIO_BACKEND's).
+
+    Underflows/overflows and stream errors are counted in METRICS under
+    "play_wave_dynamic"; errors are logged rather than raised.
+    """
+    from Modules.backends import get_backend, CallbackStop # only the playback path needs a device
+    from Modules.metrics import METRICS
+    backend = backend or get_backend()
     total_samples = len(wave)
     
     def callback(outdata, frames, time, status):
-        if status: pass
+        if status:
+            METRICS.record_stream_status("play_wave_dynamic", status)
         
         start_idx = callback.current_idx
         end_idx = start_idx + frames
@@ -40,12 +69,13 @@ def play_wave_dynamic(wave, duration):
         callback.current_idx = actual_end_idx
 
         if actual_end_idx >= total_samples:
-            raise sd.CallbackStop
+            raise CallbackStop
 
     callback.current_idx = 0
 
     try:
-        with sd.OutputStream(samplerate=SAMPLE_RATE, channels=1, callback=callback):
-            sd.sleep(int(duration * 1000) + 100)
+        with backend.open_stream(SAMPLE_RATE, 0, 1, callback):
+            backend.sleep(int(duration * 1000) + 100)
     except Exception:
-        pass # Handle audio stream error silently
\ No newline at end of file
+        METRICS.counter("play_wave_dynamic.errors").inc()
+        logging.getLogger("synth.audio").exception("audio stream error")
\ No newline at end of file
@@ -1,4 +1,6 @@
-from Modules.Libs.libs import *
+from Modules.oscillator import Oscillator
+from Modules.adsr import ADSR
+from Modules.filter import Filter
 
 class Voice:
     """Represents a single sound generation module (Oscillator + ADSR + Filter)."""
@@ -19,4 +21,4 @@ class Voice:
         # 3. Apply Filter
         filtered_wave = self.filter.apply(enveloped_wave)
         
-        return filtered_wave
\ No newline at end of file
+        return filtered_wave
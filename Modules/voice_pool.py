@@ -0,0 +1,190 @@
+import numpy as np
+
+from Modules.utils import note_to_frequency, MAX_POLYPHONY, SAMPLE_DTYPE
+from Modules.metrics import METRICS
+from Modules.render import NoteStream, GatedNoteStream
+
+STEAL_POLICIES = ("oldest", "quietest")
+
+class VoiceSlot:
+    """One preallocated voice of a VoicePool.
+
+    A slot plays either a rendered wave, a compiled Patch it renders itself with
+    its own (reused) NoteStream, or any other voice object with mix_into(out).
+    A gated patch note plays (through a GatedNoteStream) until release().
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.renderer = NoteStream()
+        self.gated_renderer = GatedNoteStream()
+        self.gated = False
+        self.velocity = 1.0
+        self.scratch = np.zeros(0, dtype=SAMPLE_DTYPE)
+        self.note = None
+        self.active = False
+        self.started = 0 # pool trigger count when the note started (smaller is older)
+        self.level = 0.0 # peak of the last mixed block
+        self.wave = None
+        self.position = 0
+        self.source = None
+        self.timeline = None # NoteTimeline of the sounding note, if it is being traced
+
+    def start(self, note, started, wave=None, patch=None, source=None, timeline=None, gated=False, velocity=1.0):
+        """(Re)starts the slot on a new note, dropping whatever it was playing."""
+        if self.timeline is not None:
+            METRICS.counter("note.cut_off").inc()
+        self.timeline = timeline
+        if timeline is not None:
+            timeline.mark('first_callback')
+        self.note = note
+        self.started = started
+        self.level = 0.0
+        self.wave = wave
+        self.position = 0
+        self.source = source
+        self.velocity = velocity
+        self.gated = gated and patch is not None
+        if self.gated:
+            self.gated_renderer.reset(patch, [note_to_frequency(note)])
+        elif patch is not None:
+            self.renderer.reset(patch, [note_to_frequency(note)])
+        self.active = wave is not None or source is not None or patch is not None
+
+    def release(self):
+        """Note-off: starts the release of a gated note (other notes play out)."""
+        if self.active and self.gated:
+            self.gated_renderer.release()
+
+    def stop(self):
+        if self.timeline is not None:
+            self.timeline.mark('last_sample')
+            METRICS.record_note(self.timeline)
+            self.timeline = None
+        self.active = False
+        self.note = None
+        self.wave = None
+        self.source = None
+
+    def mix_into(self, out):
+        """Adds the next len(out) samples to out. Returns False once the note has finished."""
+        if len(self.scratch) < len(out):
+            self.scratch = np.zeros(len(out), dtype=SAMPLE_DTYPE)
+        block = self.scratch[:len(out)]
+
+        if self.wave is not None:
+            start = self.position
+            end = min(start + len(out), len(self.wave))
+            block[:end - start] = self.wave[start:end]
+            block[end - start:] = 0.0
+            self.position = end
+            alive = end < len(self.wave)
+        elif self.source is not None:
+            block.fill(0.0)
+            alive = self.source.mix_into(block)
+        else:
+            # rendered straight into the slot's buffer
+            renderer = self.gated_renderer if self.gated else self.renderer
+            count = min(len(out), renderer.remaining)
+            renderer.next_block(count, out=block[None, :count])
+            block[count:] = 0.0
+            alive = not renderer.finished
+
+        if self.velocity != 1.0:
+            block *= self.velocity
+        self.level = float(max(np.max(block, initial=0.0), -np.min(block, initial=0.0)))
+        out += block
+        return alive
+
+
+class VoicePool:
+    """Fixed set of preallocated voices with voice stealing.
+
+    A new note takes, in order: the slot already playing the same note (when
+    retrigger is on), a free slot, or a stolen one; steal_policy picks the
+    "oldest" note or the "quietest" one (lowest peak in the last block).
+    The pool is meant to be driven from a single thread (the audio callback).
+    """
+
+    def __init__(self, max_polyphony=MAX_POLYPHONY, steal_policy="oldest", retrigger=True):
+        if steal_policy not in STEAL_POLICIES:
+            raise ValueError(f"Unknown steal policy: {steal_policy}")
+        self.slots = [VoiceSlot(i) for i in range(max(1, int(max_polyphony)))]
+        self.steal_policy = steal_policy
+        self.retrigger = retrigger
+        self.triggers = 0
+        self.steals = 0 # notes that cut off another sounding note
+        self.retriggers = 0 # notes that restarted their own previous slot
+        self.peak_active = 0
+        self.error_count = 0 # notes dropped because they raised while rendering
+        self.last_error = None
+
+    @property
+    def max_polyphony(self):
+        return len(self.slots)
+
+    @property
+    def active_count(self):
+        return sum(1 for slot in self.slots if slot.active)
+
+    def allocate(self, note=None):
+        """Returns the slot a new note should play in, stealing one if all are busy."""
+        if self.retrigger and note is not None:
+            for slot in self.slots:
+                if slot.active and slot.note == note:
+                    self.retriggers += 1
+                    return slot
+        for slot in self.slots:
+            if not slot.active:
+                return slot
+
+        self.steals += 1
+        if self.steal_policy == "quietest":
+            return min(self.slots, key=lambda slot: (slot.level, slot.started))
+        return min(self.slots, key=lambda slot: slot.started)
+
+    def note_on(self, note=None, wave=None, patch=None, source=None, timeline=None, gated=False, velocity=1.0):
+        """Starts a note from a rendered wave, a compiled Patch (played at the pitch
+        of note, held until note_off when gated) or a voice object. Returns its slot."""
+        slot = self.allocate(note)
+        self.triggers += 1
+        slot.start(note, self.triggers, wave=wave, patch=patch, source=source, timeline=timeline,
+                   gated=gated, velocity=velocity)
+        self.peak_active = max(self.peak_active, self.active_count)
+        return slot
+
+    def note_off(self, note):
+        """Releases every gated slot playing note."""
+        for slot in self.slots:
+            if slot.active and slot.note == note:
+                slot.release()
+
+    def mix_into(self, out):
+        """Mixes every active slot into out and frees the ones that have finished."""
+        for slot in self.slots:
+            if not slot.active:
+                continue
+            try:
+                if not slot.mix_into(out):
+                    slot.stop()
+            except Exception as error:
+                self.error_count += 1
+                self.last_error = error
+                METRICS.counter("voice.errors").inc()
+                slot.stop()
+
+    def reset(self):
+        """Silences every slot."""
+        for slot in self.slots:
+            slot.stop()
+
+    def stats(self):
+        return {
+            'max_polyphony': self.max_polyphony,
+            'active': self.active_count,
+            'peak_active': self.peak_active,
+            'triggers': self.triggers,
+            'steals': self.steals,
+            'retriggers': self.retriggers,
+            'errors': self.error_count,
+        }
@@ -0,0 +1,145 @@
+import threading
+import numpy as np
+
+from Modules.utils import SAMPLE_RATE, MAX_FREQ, SAMPLE_DTYPE, clamp
+from Modules.kernels import kernel
+
+TABLE_SIZE = 4096 # Samples per single-cycle table (holds up to 2047 harmonics)
+LOWEST_TABLE_FREQ = 20.0 # Top fundamental of the lowest octave table
+RENDER_TILE = 32768 # Samples (over all voices) rendered per pass to stay cache resident
+
+# Every preset is a sum of copies of a base shape at integer multiples of the
+# fundamental, weighted 1/multiple and divided by a fixed level, exactly like
+# the naive oscillator builds them.
+PRESETS = {
+    "Sine": ("sine", [1], 1.0),
+    "Square": ("square", [1], 1.0),
+    "Square*4": ("square", [1, 3, 5, 7, 9], 4.0),
+    "Square*8": ("square", list(range(1, 16, 2)), 8.0),
+    "Square*16": ("square", list(range(1, 32, 2)), 16.0),
+    "Sawtooth": ("sawtooth", [1], 1.0),
+    "Sawtooth*4": ("sawtooth", [1, 2, 3, 4], 4.0),
+    "Sawtooth*8": ("sawtooth", list(range(1, 9)), 8.0),
+    "Sawtooth*16": ("sawtooth", list(range(1, 17)), 16.0),
+}
+
+def _shape_harmonics(shape, count):
+    """Returns the sine-series amplitudes of harmonics 1..count of a base shape."""
+    m = np.arange(1, count + 1)
+    if shape == "square":
+        # sign(sin(x)) = 4/pi * sum over odd m of sin(m x) / m
+        return np.where(m % 2 == 1, 4.0 / (np.pi * m), 0.0)
+    if shape == "sawtooth":
+        # 2 * (x - floor(0.5 + x)) = 2/pi * sum of (-1)^(m+1) sin(2 pi m x) / m
+        return np.where(m % 2 == 1, 1.0, -1.0) * 2.0 / (np.pi * m)
+    return np.where(m == 1, 1.0, 0.0)
+
+class WavetableBank:
+    """Band-limited single-cycle tables for the oscillator presets, one table per octave.
+
+    Tables are built the first time a preset is used (or all at once with
+    build_all) and shared afterwards. Rendering is a phase-accumulator lookup with
+    linear interpolation, so every preset costs the same regardless of how many
+    harmonics it contains.
+    """
+
+    def __init__(self, size=TABLE_SIZE, lowest=LOWEST_TABLE_FREQ):
+        self.size = size
+        self.lowest = lowest
+        # octave o serves fundamentals up to lowest * 2**o
+        self.octaves = int(np.ceil(np.log2(MAX_FREQ / lowest))) + 1
+        self._tables = {}
+        self._lock = threading.Lock()
+        self.store = None # optional SoundBank the tables are loaded from and saved to
+
+    def has(self, waveform):
+        return waveform in PRESETS
+
+    def tables(self, waveform):
+        """Returns the (octaves, size + 1) table stack for a preset, building it on first use."""
+        tables = self._tables.get(waveform)
+        if tables is None:
+            with self._lock:
+                tables = self._tables.get(waveform)
+                if tables is None:
+                    tables = self._load_or_build(waveform)
+                    self._tables[waveform] = tables
+        return tables
+
+    def build_all(self):
+        """Builds the tables of every preset up front."""
+        for waveform in PRESETS:
+            self.tables(waveform)
+
+    def _load_or_build(self, waveform):
+        key = ('wavetable', waveform, self.size, self.lowest)
+        shape = (self.octaves, self.size + 1)
+        if self.store is not None:
+            tables = self.store.get(key)
+            if tables is not None and tables.shape == shape:
+                return tables
+        tables = self._build(waveform)
+        if self.store is not None:
+            self.store.put(key, tables)
+        return tables
+
+    def _build(self, waveform):
+        shape, multiples, level = PRESETS[waveform]
+        tables = np.empty((self.octaves, self.size + 1), dtype=SAMPLE_DTYPE)
+        for octave in range(self.octaves):
+            top = self.lowest * 2 ** octave
+            max_harmonic = int(min(SAMPLE_RATE / 2 / top, self.size / 2 - 1))
+
+            amplitudes = np.zeros(max_harmonic + 1)
+            for n in multiples:
+                count = max_harmonic // n
+                if count > 0:
+                    amplitudes[n:n * count + 1:n] += _shape_harmonics(shape, count) / n
+            amplitudes /= level
+
+            # sum of a_h * sin(2 pi h k / size) through one inverse FFT
+            spectrum = np.zeros(self.size // 2 + 1, dtype=complex)
+            spectrum[1:max_harmonic + 1] = -0.5j * self.size * amplitudes[1:]
+            tables[octave, :-1] = np.fft.irfft(spectrum, self.size)
+            tables[octave, -1] = tables[octave, 0] # guard point for interpolation
+        return tables
+
+    def octave_for(self, frequency):
+        """Returns the index of the table whose harmonics stay below Nyquist at frequency."""
+        octave = int(np.ceil(np.log2(max(abs(frequency), 1e-9) / self.lowest)))
+        return int(clamp(octave, 0, self.octaves - 1))
+
+    def render(self, waveform, frequency, n_samples, phase=0.0, amplitude=1.0, out=None):
+        """Renders n_samples of a preset starting at phase (in cycles).
+
+        frequency (and phase) may be 1-D arrays, giving a (voices, samples) result
+        where each row reads from the table matching its own frequency. The result
+        has the tables' SAMPLE_DTYPE and is written into out when it is given;
+        phases are kept in float64 so long notes stay in tune.
+        """
+        tables = self.tables(waveform)
+        shape = (n_samples,) if np.ndim(frequency) == 0 else (np.shape(frequency)[0], n_samples)
+        wave = np.empty(shape, dtype=tables.dtype) if out is None else out
+        rows = wave if wave.ndim == 2 else wave[None]
+
+        frequency = np.atleast_1d(np.asarray(frequency, dtype=float))
+        octaves = np.array([self.octave_for(f) for f in frequency])
+        offsets = octaves * (self.size + 1)
+        steps = frequency / SAMPLE_RATE
+        phases = np.broadcast_to(np.asarray(phase, dtype=float).reshape(-1), frequency.shape)
+
+        # work through the note in column tiles so the temporaries stay in cache
+        # however many voices are rendered together
+        flat = tables.reshape(-1)
+        lookup = kernel("table_lookup")
+        tile = max(RENDER_TILE // rows.shape[0], 256)
+        for start in range(0, n_samples, tile):
+            stop = min(start + tile, n_samples)
+            lookup(flat, offsets, steps, phases, self.size, start, rows[:, start:stop])
+
+        if amplitude != 1.0:
+            wave *= amplitude
+        return wave
+
+# Shared by every oscillator
+WAVETABLES = WavetableBank()
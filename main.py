@@ -1,16 +1,85 @@
 from Modules.Libs.libs import *
 import tkinter as tk
+from tkinter import filedialog, messagebox
+from concurrent.futures import ThreadPoolExecutor
+import logging
 import math
+import os
 
 class SynthApp:
     def __init__(self, root):
         self.root = root
         self.root.title("SynthPythor")
         self.root.geometry("1200x850")
-        
+
+        # Keys hold their note until they are lifted: presses and releases are
+        # timestamped events the audio callback applies at their exact sample
+        # offset, rendering the note as it plays. False plays fixed-length notes
+        # instead, rendered ahead of time: the render cache, the rendered notes of
+        # the sound bank and the keyboard pre-render only exist in that mode.
+        self.gated_notes = True
+
         self._init_variables()
         self._setup_gui()
 
+        # The oscillator tables (and, for fixed-length notes, the rendered notes)
+        # are kept on disk so later sessions start warm
+        self.sound_bank = SoundBank(SOUND_BANK_DIR)
+        self.render_cache = None
+        self.prerender = None
+        self.render_workers = None
+        if not self.gated_notes:
+            # Rendered notes are reused until a parameter changes
+            self.render_cache = RenderCache(max_mb=64, bank=self.sound_bank)
+            self.prerender = PreRenderer(self.render_cache, notes=KEYBOARD_NOTES)
+            # Note renders are dispatched to a small fixed set of threads instead of one
+            # thread per key press; each render spreads its voices over the shared executor
+            self.render_workers = ThreadPoolExecutor(max_workers=2)
+
+        # Fixed-length notes: stream them block by block from the audio callback
+        # instead of rendering them up front (starts within one block; both paths
+        # go through the engine's limiter, so they play at the same level)
+        self.stream_notes = False
+
+        # Settings are compiled into an immutable Patch whenever a parameter
+        # changes, so a key press only pairs the patch with a pitch
+        self._patch_pending = False
+        self._compile_patch()
+        self._watch_parameters()
+        if self.prerender is not None:
+            self._poll_prerender()
+
+        # Build (or load) the band-limited oscillator tables before the first key press
+        WAVETABLES.store = self.sound_bank
+        WAVETABLES.build_all()
+        # and compile the inner-loop kernels when a JIT backend is active
+        prepare_kernels()
+
+        # One output stream for the app's lifetime; at most MAX_POLYPHONY notes are
+        # mixed into it, further notes steal the oldest one (same key: retrigger)
+        self.engine = AudioEngine(max_polyphony=MAX_POLYPHONY, steal_policy="oldest")
+        self.engine.start()
+        self._watch_effects()
+
+        # Latency/underflow metrics are always collected in METRICS; set a path to
+        # also dump them as JSON (and log a summary) every 10 s
+        self.metrics_path = None
+        self.metrics_reporter = MetricsReporter(METRICS, interval=10.0, path=self.metrics_path)
+        if self.metrics_path:
+            self.metrics_reporter.start()
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+
+    def _on_close(self):
+        if self.prerender is not None:
+            self.prerender.cancel()
+        self.engine.stop()
+        if self.render_workers is not None:
+            self.render_workers.shutdown(wait=False)
+        self.sound_bank.flush()
+        if self.metrics_path:
+            self.metrics_reporter.stop()
+        self.root.destroy()
+
     def _init_variables(self):
         # Voice 1 Variables (Osc 1 / Filter 1 / Env 1)
         self.osc1_waveform = ctk.StringVar(value="Sawtooth")
@@ -44,14 +113,98 @@ class SynthApp:
         self.amp_sustain = ctk.DoubleVar(value=0)
         self.amp_release = ctk.DoubleVar(value=0.1)
 
-    def play_note(self, note):
-        """Triggers note playback in a separate thread."""
-        
-        # Capture current state from GUI variables
-        state = {
-            'note': note,
+        # LFO (routed to both filter cutoffs and to the amplitude)
+        self.lfo_rate = ctk.DoubleVar(value=5.0) # Hz
+        self.lfo_shape = ctk.StringVar(value="Sine")
+        self.lfo_cutoff = ctk.DoubleVar(value=0.0) # octaves
+        self.lfo_amp = ctk.DoubleVar(value=0.0) # 0 to 1
+
+        # Master-bus reverb: an engine effect rather than a patch setting, so it is
+        # kept out of the traced patch variables (see _watch_effects)
+        self.effect_vars = {
+            'reverb': ctk.StringVar(value="None"), # REVERB_PRESETS name or loaded response
+            'reverb_mix': ctk.DoubleVar(value=0.3), # wet level
+        }
+        # the partition spectra of a response are computed once, the first time it is selected
+        self._convolvers = {} # response name -> PartitionedConvolver
+        self._ir_files = {} # menu label -> path of a loaded impulse response
+
+    def _watch_parameters(self):
+        """Invalidates the render cache whenever any synth parameter changes."""
+        for var in vars(self).values():
+            if isinstance(var, tk.Variable):
+                var.trace_add('write', self._on_parameter_change)
+
+    def _watch_effects(self):
+        for var in self.effect_vars.values():
+            var.trace_add('write', self._on_effect_change)
+
+    def _on_effect_change(self, *args):
+        """Hands the selected reverb (or none) to the engine and sets its level."""
+        name = self.effect_vars['reverb'].get()
+        if name == "Load IR...":
+            self._load_impulse_response()
+            return
+        if name == "None":
+            self.engine.set_effects(())
+            return
+        convolver = self._convolvers.get(name)
+        if convolver is None:
+            convolver = PartitionedConvolver(preset_impulse_response(self._ir_files.get(name, name)), dry=1.0)
+            self._convolvers[name] = convolver
+        convolver.wet = self.effect_vars['reverb_mix'].get()
+        if self.engine.effects != (convolver,):
+            convolver.reset() # drop the tail of its last use
+            self.engine.set_effects((convolver,))
+
+    def _load_impulse_response(self):
+        """Asks for an impulse response file and selects it (or goes back to no reverb)."""
+        path = filedialog.askopenfilename(title="Load impulse response",
+                                          filetypes=[("Impulse responses", "*.wav *.npy"), ("All files", "*")])
+        if not path:
+            self.effect_vars['reverb'].set("None")
+            return
+        label = os.path.basename(path)
+        try:
+            self._convolvers[label] = PartitionedConvolver(load_impulse_response(path), dry=1.0)
+        except (OSError, ValueError) as error:
+            messagebox.showerror("Impulse response", f"Could not load {label}: {error}")
+            self.effect_vars['reverb'].set("None")
+            return
+        self._ir_files[label] = path
+        self.reverb_menu.configure(values=self._reverb_choices())
+        self.effect_vars['reverb'].set(label)
+
+    def _reverb_choices(self):
+        return ["None"] + list(REVERB_PRESETS) + list(self._ir_files) + ["Load IR..."]
+
+    def _on_parameter_change(self, *args):
+        if self.render_cache is not None:
+            self.render_cache.clear()
+        # recompile once the burst of trace callbacks (e.g. a slider drag step) is over
+        if not self._patch_pending:
+            self._patch_pending = True
+            self.root.after_idle(self._compile_patch)
+
+    def _compile_patch(self):
+        """Reads the GUI variables and compiles them into the Patch used by every press."""
+        self._patch_pending = False
+        self.patch = compile_patch(self._patch_state())
+        # render the whole keyboard once the settings have been left alone for a moment
+        # (only fixed-length notes are played from the cache)
+        if self.prerender is not None:
+            self.prerender.schedule(self.patch)
+
+    def _poll_prerender(self):
+        """Shows the background pre-render progress (polled, as Tk is not thread safe)."""
+        done, total = self.prerender.progress
+        self.prerender_label.configure(text=f"Pre-rendered {done}/{total} notes" if total else "")
+        self.root.after(250, self._poll_prerender)
+
+    def _patch_state(self):
+        """Captures the current settings from the GUI variables as a state dict."""
+        return {
             'duration': 0.5,
-            'freq': note_to_frequency(note),
             
             'voice1_params': {
                 'waveform': self.osc1_waveform.get(),
@@ -86,91 +239,73 @@ class SynthApp:
                 'attack': self.amp_attack.get(), 'decay': self.amp_decay.get(),
                 'sustain': self.amp_sustain.get(), 'release': self.amp_release.get()
             },
-            'mix_level': self.osc2_mix.get() / 100.0
+            'mix_level': self.osc2_mix.get() / 100.0,
+            # Evaluated at the control rate when the patch is compiled
+            'modulation': {
+                'lfos': {'lfo1': {'rate': self.lfo_rate.get(), 'shape': self.lfo_shape.get()}},
+                'routes': [
+                    {'source': 'lfo1', 'target': 'voice1.cutoff', 'amount': self.lfo_cutoff.get()},
+                    {'source': 'lfo1', 'target': 'voice2.cutoff', 'amount': self.lfo_cutoff.get()},
+                    {'source': 'lfo1', 'target': 'amp', 'amount': self.lfo_amp.get()}
+                ]
+            }
         }
-        
-        threading.Thread(target=self._play_in_thread, args=(state,)).start()
-
 
-    def _play_in_thread(self, state):
-        """The core audio generation and mixing thread function."""
-        def generate_voice_with_unison(osc_params, filter_params, filter_adsr_vars, amp_adsr_vars, base_freq, duration):
-            """Generate a voice with optional unison (multiple slightly detuned oscillators)."""
-            unison_count = osc_params.get('unison', 1)
-            waveform = osc_params['waveform']
-            detune = osc_params['detune']
-            
-            # Generate unison voices
-            unison_waves = []
-            for i in range(unison_count):
-                # Spread unison voices in detune cents
-                # Voice 0 is at detune
-                # Other voices spread around base detune
-                if unison_count == 1:
-                    voice_detune = detune
-                else:
-                    spread = 30  # cents spread around center
-                    voice_detune = detune + (i - (unison_count - 1) / 2.0) * (spread / (unison_count - 1))
-                
-                detune_ratio = 2 ** (voice_detune / 1200.0)
-                freq = base_freq * detune_ratio
-                
-                osc = Oscillator(waveform)
-                raw_wave = osc.generate(freq, duration)
-                unison_waves.append(raw_wave)
-            
-            # Mix unison voices (average)
-            mixed_wave = np.mean(unison_waves, axis=0)
-            
-            # Apply filter
-            filter_obj = Filter(**filter_params)
-            filter_env_adsr = ADSR(**filter_adsr_vars)
-            filter_env = filter_env_adsr.get_envelope(duration, total_samples=len(mixed_wave))
-            cutoff_knob = clamp(filter_obj.cutoff, 20, MAX_FREQ)
-            min_cut = 20.0
-            cutoff_env = min_cut + filter_env * (cutoff_knob - min_cut)
-            filtered = filter_obj.apply(mixed_wave, cutoff_envelope=cutoff_env)
-            
-            # Apply amplitude ADSR
-            amp_adsr = ADSR(**amp_adsr_vars)
-            final = amp_adsr.apply_envelope(filtered, duration)
-            
-            return final
-
-        # 1. Generate Voice 1 with unison
-        wave1 = generate_voice_with_unison(
-            state['voice1_params'],
-            state['voice1_params']['filter_vars'],
-            state['voice1_params']['adsr_vars'],
-            state['amp_adsr_vars'],
-            state['freq'],
-            state['duration']
-        )
-
-        # 2. Process Voice 2 and Mix
-        final_wave = wave1
-        if state['use_voice2']:
-            wave2 = generate_voice_with_unison(
-                state['voice2_params'],
-                state['voice2_params']['filter_vars'],
-                state['voice2_params']['adsr_vars'],
-                state['amp_adsr_vars'],
-                state['freq'],
-                state['duration']
-            )
-
-            # Ensure same length for mixing
-            min_len = min(len(wave1), len(wave2))
-            wave1 = wave1[:min_len]
-            wave2 = wave2[:min_len]
-
-            mix_level = state['mix_level']
-            final_wave = (1.0 - mix_level) * wave1 + mix_level * wave2
-
-        # 3. Final normalization and playback
-        final_wave = normalize_wave(final_wave)
-        play_wave_dynamic(final_wave, state['duration'])
+    def key_down(self, note, event=None):
+        """Piano key pressed: starts a held note, or plays a fixed-length one."""
+        if not self.gated_notes:
+            self.play_note(note)
+            return
+        # the audio callback marks first_callback when the note starts and
+        # last_sample when its release has played out
+        timeline = NoteTimeline(note)
+        if self._patch_pending:
+            self._compile_patch()
+        self.engine.port.note_on(note, patch=self.patch, timeline=timeline)
+
+    def key_up(self, note, event=None):
+        """Piano key lifted: releases the held note."""
+        if self.gated_notes:
+            self.engine.port.note_off(note)
 
+    def play_note(self, note):
+        """Pairs the compiled patch with the note and queues it on the audio engine."""
+        timeline = NoteTimeline(note)
+        if self._patch_pending:
+            self._compile_patch()
+        patch = self.patch
+
+        if self.stream_notes:
+            # rendered in the audio callback by the (reused) objects of its voice slot
+            self.engine.note_on(note, patch=patch, timeline=timeline)
+            return
+
+        # pre-rendered notes go straight to the engine without a render thread
+        final_wave = self.render_cache.get((patch.key, note))
+        if final_wave is not None:
+            self.engine.play_wave(final_wave, note=note, timeline=timeline)
+            return
+
+        self.render_workers.submit(self._play_in_thread, patch, note, timeline).add_done_callback(self._check_render)
+
+    def _check_render(self, future):
+        """Render worker finished: counts and logs a failed render, which would vanish otherwise."""
+        if future.cancelled() or future.exception() is None:
+            return
+        METRICS.counter("render.errors").inc()
+        logging.getLogger("synth.render").error("note render failed", exc_info=future.exception())
+
+
+    def _play_in_thread(self, patch, note, timeline=None):
+        """Renders a note the cache missed (play_note looked it up, so the miss is
+        counted once), stores it and queues it for playback."""
+        if timeline is not None:
+            timeline.mark('render_start')
+        with self.prerender.foreground():
+            final_wave = self.render_cache.put((patch.key, note), render_patch_note(patch, note_to_frequency(note)))
+        if timeline is not None:
+            timeline.mark('render_end')
+        self.engine.play_wave(final_wave, note=note, timeline=timeline)
 
     # --- GUI Helper Methods (Copied from previous implementation) ---
 
@@ -346,6 +481,27 @@ class SynthApp:
         ctk.CTkLabel(frame, text=label, font=ctk.CTkFont(weight="bold")).grid(row=0, column=0, columnspan=4, padx=10, pady=5)
         self._create_adsr_sliders(frame, attack_var, decay_var, sustain_var, release_var)
 
+    def _create_lfo_frame(self, parent_frame, row, col, label, rate_var, shape_var, cutoff_var, amp_var):
+        frame = ctk.CTkFrame(parent_frame)
+        frame.grid(row=row, column=col, padx=10, pady=10, sticky="n")
+        ctk.CTkLabel(frame, text=label, font=ctk.CTkFont(weight="bold")).grid(row=0, column=0, columnspan=3, padx=10, pady=5)
+        ctk.CTkOptionMenu(frame, values=list(LFO_SHAPES), variable=shape_var).grid(row=1, column=0, columnspan=3, padx=5, pady=5)
+        self._create_knob(frame, 2, 0, "Rate (Hz)", rate_var, 0.1, 20)
+        self._create_knob(frame, 2, 1, "Cutoff (oct)", cutoff_var, 0, 4)
+        self._create_knob(frame, 2, 2, "Amp", amp_var, 0, 1)
+
+    def _create_reverb_frame(self, parent_frame, row, col, label):
+        frame = ctk.CTkFrame(parent_frame)
+        frame.grid(row=row, column=col, padx=10, pady=10, sticky="n")
+        ctk.CTkLabel(frame, text=label, font=ctk.CTkFont(weight="bold")).grid(row=0, column=0, padx=10, pady=5)
+        self.reverb_menu = ctk.CTkOptionMenu(frame, values=self._reverb_choices(), variable=self.effect_vars['reverb'])
+        self.reverb_menu.grid(row=1, column=0, padx=5, pady=5)
+        self._create_knob(frame, 2, 0, "Mix", self.effect_vars['reverb_mix'], 0, 1)
+
+    def _bind_key(self, button, midi_note):
+        button.bind("<ButtonPress-1>", partial(self.key_down, midi_note))
+        button.bind("<ButtonRelease-1>", partial(self.key_up, midi_note))
+
     def _create_piano_keys(self, piano_frame):
         white_keys = [
             ("C", 48), ("D", 50), ("E", 52), ("F", 53), ("G", 55), ("A", 57), ("B", 59),
@@ -361,17 +517,19 @@ class SynthApp:
         ]
         for i, (key, midi_note) in enumerate(white_keys):
             button = ctk.CTkButton(
-                piano_frame, text="", command=partial(self.play_note, midi_note),
+                piano_frame, text="",
                 width=50, height=150, fg_color="white", text_color="black", corner_radius=0
             )
+            self._bind_key(button, midi_note)
             button.grid(row=0, column=i, padx=0, pady=0, sticky="n")
         for i, key_data in enumerate(black_keys):
             if key_data is None: continue
             key, midi_note = key_data
             button = ctk.CTkButton(
-                piano_frame, text="", command=partial(self.play_note, midi_note),
+                piano_frame, text="",
                 width=30, height=100, fg_color="black", text_color="white", corner_radius=0
             )
+            self._bind_key(button, midi_note)
             button.place(x=(50 * i + 35), y=0) 
 
     def _setup_gui(self):
@@ -387,6 +545,8 @@ class SynthApp:
         self._create_adsr_frame(controls_frame, 0, 4, "Filter 2 Env", self.osc2_filter_attack, self.osc2_filter_decay, self.osc2_filter_sustain, self.osc2_filter_release)
 
         self._create_adsr_frame(controls_frame,0, 5, "Amp Env", self.amp_attack, self.amp_decay, self.amp_sustain, self.amp_release)
+        self._create_lfo_frame(controls_frame, 1, 1, "LFO", self.lfo_rate, self.lfo_shape, self.lfo_cutoff, self.lfo_amp)
+        self._create_reverb_frame(controls_frame, 1, 2, "Reverb")
         
         # Make controls_frame height dynamic to match content
         controls_frame.update_idletasks()
@@ -396,6 +556,10 @@ class SynthApp:
         piano_frame.pack(side="bottom", fill="x")
         self._create_piano_keys(piano_frame)
 
+        if not self.gated_notes:
+            self.prerender_label = ctk.CTkLabel(self.root, text="")
+            self.prerender_label.pack(side="bottom")
+
 if __name__ == "__main__":
     ctk.set_appearance_mode("dark")
     ctk.set_default_color_theme("blue")